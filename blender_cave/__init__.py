@@ -91,10 +91,10 @@ class Main:
             # Configure the synchronizer: check differences between frames to exchange between the master and the slaves
             if self.isMaster():
                 from .synchronizer import master as synchronizer
-                self._synchronizer = synchronizer.Master(self)
+                self._synchronizer = synchronizer.Master(self, configuration['synchronizer'])
             else:
                 from .synchronizer import slave as synchronizer
-                self._synchronizer = synchronizer.Slave(self)
+                self._synchronizer = synchronizer.Slave(self, configuration['synchronizer'])
 
             # Configure the users
             from . import user
@@ -185,6 +185,16 @@ class Main:
         The reason is printed inside the log file of displayed on the console"""
         self._network.quit(reason)
 
+    def getMasterTime(self):
+        """Get the current time of the master clock
+
+        On the slaves, it is estimated from the exchanges with the master. Usefull to compare timestamps between the nodes"""
+        return self._network.getMasterTime()
+
+    def getFrameTime(self):
+        """Get the time (master clock) of the last synchronizer frame received (None on the master)"""
+        return self._network.getFrameTime()
+
     def numberScreens(self):
         return self._number_screens
 
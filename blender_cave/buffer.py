@@ -36,118 +36,256 @@
 
 import struct
 import mathutils
+import blender_cave.exceptions
+
+# Encoding of the sizes and of the item IDs, negotiated with the master at connection :
+#  - fixed : 4 bytes for the sizes, 8 bytes for the item IDs,
+#  - varint : LEB128 (7 bits per byte, the highest bit tells that another byte follows).
+PROTOCOL_FIXED  = 1
+PROTOCOL_VARINT = 2
+# Highest version supported
+PROTOCOL        = PROTOCOL_VARINT
+
+# Compiled once : struct does not parse the format at each call
+_COMMAND       = struct.Struct('c')
+_BOOLEAN       = struct.Struct('?')
+_UNSIGNED_CHAR = struct.Struct('B')
+_INTEGER       = struct.Struct('>i')
+_ITEM_ID       = struct.Struct('>Q')
+_FLOAT         = struct.Struct('>f')
+_DOUBLE        = struct.Struct('>d')
+_VECTOR_3      = struct.Struct('>3f')
+_VECTOR_4      = struct.Struct('>4f')
+_MATRIX_3X3    = struct.Struct('>9f')
+_MATRIX_4X4    = struct.Struct('>16f')
+
+def setProtocol(version):
+    """Select the encoding of the sizes and of the item IDs of all the buffers"""
+    if version == PROTOCOL_FIXED:
+        Buffer.size    = Buffer._fixedSize
+        Buffer.itemID  = Buffer._fixedItemID
+        Buffer.itemIDs = Buffer._fixedItemIDs
+    elif version == PROTOCOL_VARINT:
+        Buffer.size    = Buffer._varint
+        Buffer.itemID  = Buffer._varint
+        Buffer.itemIDs = Buffer._varints
+    else:
+        raise blender_cave.exceptions.Controller("Unknown protocol version : " + str(version))
 
 class Buffer:
+    """Binary buffer used to exchange data between the master and the slaves.
 
-    def __init__(self):
-        self._buffer = b''
+    Writing appends to a bytearray. Reading moves a cursor over a memoryview,
+    so decoding never copies the remaining bytes and subBuffer() returns a
+    view on the parent data instead of a new bytes object.
+
+    getData(), subBuffer() and raw() export views on the bytes : a buffer is
+    read only as long as such a view is alive (writing into it raises a
+    Controller exception).
+
+    size() and itemID() depend on the protocol version (see setProtocol)."""
+
+    def __init__(self, data = None):
+        if data is None:
+            self._buffer = bytearray()
+        else:
+            self._buffer = memoryview(data)
+        self._offset = 0
 
     def __len__(self):
-        return len(self._buffer)
+        return len(self._buffer) - self._offset
 
     def isEmpty(self):
         return (len(self) == 0)
 
+    def getData(self):
+        """Get a memoryview on the remaining (not yet read) bytes
+
+        The buffer cannot be written until the view is released"""
+        return memoryview(self._buffer)[self._offset:]
+
     def command(self, data = None):
-        return self._simpleData('c', data)
+        return self._simpleData(_COMMAND, data)
 
     def boolean(self, data = None):
-        return self._simpleData('?', data)
+        return self._simpleData(_BOOLEAN, data)
 
     def unsigned_char(self, data = None):
-        return self._simpleData('B', data)
+        return self._simpleData(_UNSIGNED_CHAR, data)
+
+    def _fixedSize(self, data = None):
+        return self._simpleData(_INTEGER, data)
+
+    def _fixedItemID(self, data = None):
+        return self._simpleData(_ITEM_ID, data)
 
-    def size(self, data = None):
-        return self.integer(data)
+    def _varint(self, data = None):
+        """Unsigned LEB128 integer"""
+        if data is None:
+            buffer = self._buffer
+            offset = self._offset
+            byte   = buffer[offset]
+            offset += 1
+            value  = byte & 0x7f
+            shift  = 7
+            while byte & 0x80:
+                byte    = buffer[offset]
+                offset += 1
+                value  |= (byte & 0x7f) << shift
+                shift  += 7
+            self._offset = offset
+            return value
+        if data < 0x80:
+            self._write(_UNSIGNED_CHAR.pack(data))
+            return
+        encoded = bytearray()
+        while data >= 0x80:
+            encoded.append((data & 0x7f) | 0x80)
+            data >>= 7
+        encoded.append(data)
+        self._write(encoded)
+
+    def _fixedItemIDs(self, data = None, count = 0):
+        if data is None:
+            values = struct.unpack_from('>' + str(count) + 'Q', self._buffer, self._offset)
+            self._offset += _ITEM_ID.size * count
+            return values
+        self._write(struct.pack('>' + str(len(data)) + 'Q', *data))
 
-    def itemID(self, data = None):
-        return self._simpleData('>Q', data)
+    def _varints(self, data = None, count = 0):
+        """Sequence of unsigned LEB128 integers, without their count"""
+        if data is None:
+            return [self._varint() for index in range(count)]
+        encoded = bytearray()
+        for value in data:
+            while value >= 0x80:
+                encoded.append((value & 0x7f) | 0x80)
+                value >>= 7
+            encoded.append(value)
+        self._write(encoded)
+
+    size    = _varint
+    itemID  = _varint
+    itemIDs = _varints
 
     def integer(self, data = None):
-        return self._simpleData('>i', data)
+        return self._simpleData(_INTEGER, data)
 
     def float(self, data = None):
-        return self._simpleData('>f', data)
+        return self._simpleData(_FLOAT, data)
+
+    def double(self, data = None):
+        return self._simpleData(_DOUBLE, data)
 
     def subBuffer(self, data = None):
         if data is None:
-            data = Buffer()
-            data._buffer = self._subBytes(None)
-            return data
-        self._subBytes(data._buffer)
+            return Buffer(self._subBytes(None))
+        self._subBytes(data.getData())
+
+    def raw(self, data = None, size = 0):
+        """Raw bytes, without any size prefix: the reader must know the size"""
+        if data is None:
+            start = self._offset
+            self._offset += size
+            return memoryview(self._buffer)[start:self._offset]
+        self._write(data)
 
     def string(self, data = None):
         if data is None:
-            return self._subBytes(None).decode('UTF-8')
+            return bytes(self._subBytes(None)).decode('UTF-8')
         self._subBytes(bytes(data, 'UTF-8'))
 
     def vector_3(self, data = None):
         if data is None:
-            data = self._extract(">3f")
+            data = self._extract(_VECTOR_3)
             return mathutils.Vector(data)
-        self._buffer += struct.pack(">3f", data[0], data[1], data[2])
+        self._write(_VECTOR_3.pack(data[0], data[1], data[2]))
 
     def vector_4(self, data = None):
         if data is None:
-            data = self._extract(">4f")
+            data = self._extract(_VECTOR_4)
             return mathutils.Vector(data)
-        self._buffer += struct.pack(">4f", data[0], data[1], data[2], data[3])
+        self._write(_VECTOR_4.pack(data[0], data[1], data[2], data[3]))
 
     def matrix_3x3(self, data = None):
         if data is None:
-            data = self._extract(">9f")
+            data = self._extract(_MATRIX_3X3)
             return mathutils.Matrix(((data[0], data[1], data[2]),
                                      (data[3], data[4], data[5]),
                                      (data[6], data[7], data[8])))
-        self._buffer += struct.pack(">9f", data[0][0], data[0][1], data[0][2],
-                                           data[1][0], data[1][1], data[1][2],
-                                           data[2][0], data[2][1], data[2][2])
+        self._write(_MATRIX_3X3.pack(data[0][0], data[0][1], data[0][2],
+                                     data[1][0], data[1][1], data[1][2],
+                                     data[2][0], data[2][1], data[2][2]))
         
     def matrix_4x4(self, data = None):
         if data is None:
-            data = self._extract(">16f")
+            data = self._extract(_MATRIX_4X4)
             return mathutils.Matrix(((data[ 0], data[ 1], data[ 2], data[ 3]),
                                      (data[ 4], data[ 5], data[ 6], data[ 7]),
                                      (data[ 8], data[ 9], data[10], data[11]),
                                      (data[12], data[13], data[14], data[15])))
 
-        self._buffer += struct.pack(">16f", data[0][0], data[0][1], data[0][2], data[0][3],
-                                            data[1][0], data[1][1], data[1][2], data[1][3],
-                                            data[2][0], data[2][1], data[2][2], data[2][3],
-                                            data[3][0], data[3][1], data[3][2], data[3][3])
+        self._write(_MATRIX_4X4.pack(data[0][0], data[0][1], data[0][2], data[0][3],
+                                     data[1][0], data[1][1], data[1][2], data[1][3],
+                                     data[2][0], data[2][1], data[2][2], data[2][3],
+                                     data[3][0], data[3][1], data[3][2], data[3][3]))
 
     def addPrefix(self, prefix):
         if isinstance(prefix, Buffer):
-            self._buffer = prefix._buffer + self._buffer
+            self._writable()
+            try:
+                self._buffer[0:0] = prefix.getData()
+            except BufferError:
+                self._viewed()
             return self
 
+    def _writable(self):
+        # A buffer received from the network is a read only view: copy its
+        # remaining bytes the first time someone writes into it
+        if not isinstance(self._buffer, bytearray):
+            self._buffer = bytearray(self._buffer[self._offset:])
+            self._offset = 0
+
+    def _write(self, data):
+        self._writable()
+        try:
+            self._buffer += data
+        except BufferError:
+            self._viewed()
+
+    def _viewed(self):
+        # The bytearray cannot be resized while a memoryview exports it
+        raise blender_cave.exceptions.Controller("Buffer written while a view on its data is still alive (getData, subBuffer or raw) : release it or copy the data first")
+
     def _subBytes(self, data = None):
         if data is None:
-            size = self.size()
-            buffer = self._buffer[:size]
-            self._buffer = self._buffer[size:]
-            return buffer
+            size  = self.size()
+            start = self._offset
+            self._offset += size
+            return memoryview(self._buffer)[start:self._offset]
         self.size(len(data))
-        self._buffer += data
+        self._write(data)
 
-    def _extract(self, format):
-        values = struct.unpack_from(format, self._buffer)
-        self._buffer = self._buffer[struct.calcsize(format):]
+    def _extract(self, codec):
+        values = codec.unpack_from(self._buffer, self._offset)
+        self._offset += codec.size
         return values
 
-    def _simpleData(self, format, data):
+    def _simpleData(self, codec, data):
         if data is None:
-            data = self._extract(format)
-            return data[0]
-        self._buffer += struct.pack(format, data)
+            value = codec.unpack_from(self._buffer, self._offset)[0]
+            self._offset += codec.size
+            return value
+        self._write(codec.pack(data))
 
     def __iadd__(self, other):
         if isinstance(other, Buffer):
-            self._buffer += other._buffer
+            self._write(other.getData())
             return self
 
     def __add__(self, other):
         if isinstance(other, Buffer):
             result = Buffer()
-            result._buffer = self._buffer + other._buffer
+            result._write(self.getData())
+            result._write(other.getData())
             return result
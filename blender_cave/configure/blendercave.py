@@ -49,6 +49,83 @@ class BlenderCave(base.Base):
             self._synchroAddress = attrs['synchroAddress']
         else:
             self._synchroAddress = '225.0.0.37'
+        if 'synchroTransport' in attrs:
+            self._synchroTransport = attrs['synchroTransport'].lower()
+            if self._synchroTransport not in ('tcp', 'multicast'):
+                self.raise_error('Invalid synchroTransport "' + attrs['synchroTransport'] + '" : must be "tcp" or "multicast"')
+        else:
+            self._synchroTransport = 'tcp'
+        if 'synchroEncoding' in attrs:
+            self._synchroEncoding = attrs['synchroEncoding'].lower()
+            if self._synchroEncoding not in ('float', 'compact'):
+                self.raise_error('Invalid synchroEncoding "' + attrs['synchroEncoding'] + '" : must be "float" or "compact"')
+        else:
+            self._synchroEncoding = 'float'
+        if 'synchroCompression' in attrs:
+            self._synchroCompression = attrs['synchroCompression'].lower()
+            if self._synchroCompression not in ('none', 'zlib', 'lz4'):
+                self.raise_error('Invalid synchroCompression "' + attrs['synchroCompression'] + '" : must be "none", "zlib" or "lz4"')
+        else:
+            self._synchroCompression = 'none'
+        if 'synchroProtocol' in attrs:
+            try:
+                self._synchroProtocol = int(attrs['synchroProtocol'])
+            except ValueError:
+                self._synchroProtocol = 0
+            if self._synchroProtocol not in (1, 2):
+                self.raise_error('Invalid synchroProtocol "' + attrs['synchroProtocol'] + '" : must be 1 or 2')
+        else:
+            self._synchroProtocol = 2
+        if 'synchroBandwidth' in attrs:
+            try:
+                self._synchroBandwidth = float(attrs['synchroBandwidth'])
+            except ValueError:
+                self.raise_error('Invalid synchroBandwidth "' + attrs['synchroBandwidth'] + '" : must be a number of Mbit/s')
+        else:
+            self._synchroBandwidth = 1000.0
+        # None : automatic, decided once the screens are known
+        self._synchroSharedMemory = None
+        if ('synchroSharedMemory' in attrs) and (attrs['synchroSharedMemory'].lower() != 'auto'):
+            try:
+                self._synchroSharedMemory = int(attrs['synchroSharedMemory'])
+            except ValueError:
+                self.raise_error('Invalid synchroSharedMemory "' + attrs['synchroSharedMemory'] + '" : must be "auto" or a number of MB')
+        if 'synchroRelay' in attrs:
+            self._synchroRelay = (attrs['synchroRelay'].lower() == 'true')
+        else:
+            self._synchroRelay = False
+        if 'synchroTree' in attrs:
+            try:
+                self._synchroTree = int(attrs['synchroTree'])
+            except ValueError:
+                self.raise_error('Invalid synchroTree "' + attrs['synchroTree'] + '" : must be the number of children of each node')
+        else:
+            self._synchroTree = 0
+        if 'synchroTransforms' in attrs:
+            self._synchroTransforms = attrs['synchroTransforms'].lower()
+            if self._synchroTransforms not in ('reliable', 'datagram'):
+                self.raise_error('Invalid synchroTransforms "' + attrs['synchroTransforms'] + '" : must be "reliable" or "datagram"')
+            if (self._synchroTransforms == 'datagram') and (self._synchroRelay or (self._synchroTree > 0)):
+                self.raise_error('synchroTransforms "datagram" cannot be used with synchroRelay or synchroTree')
+        else:
+            self._synchroTransforms = 'reliable'
+        if 'synchroSmoothing' in attrs:
+            self._synchroSmoothing = attrs['synchroSmoothing'].lower()
+            if self._synchroSmoothing not in ('none', 'interpolate', 'extrapolate'):
+                self.raise_error('Invalid synchroSmoothing "' + attrs['synchroSmoothing'] + '" : must be "none", "interpolate" or "extrapolate"')
+        else:
+            self._synchroSmoothing = 'none'
+        if 'synchroBarrier' in attrs:
+            self._synchroBarrier = (attrs['synchroBarrier'].lower() == 'true')
+        else:
+            self._synchroBarrier = False
+        if 'synchroBarrierTimeout' in attrs:
+            try:
+                self._synchroBarrierTimeout = float(attrs['synchroBarrierTimeout'])
+            except ValueError:
+                self.raise_error('Invalid synchroBarrierTimeout "' + attrs['synchroBarrierTimeout'] + '" : must be a number of milliseconds')
+        else:
+            self._synchroBarrierTimeout = 50.0
         if 'focus_master' in attrs:
             focus_console = attrs['focus_master']
             if focus_console.lower() == 'true':
@@ -86,7 +163,7 @@ class BlenderCave(base.Base):
         return self.addChild(child)
 
     def display(self, indent):
-        self.print_display(indent, 'Virtual environment : ' + self._name + ', ' + str(self._synchroPort) + ', ' + self._synchroAddress)
+        self.print_display(indent, 'Virtual environment : ' + self._name + ', ' + str(self._synchroPort) + ', ' + self._synchroAddress + ' (' + self._synchroTransport + ', ' + self._synchroEncoding + ', compression : ' + self._synchroCompression + ')')
         super(BlenderCave, self).display(indent)
 
     def getConfiguration(self):
@@ -107,6 +184,22 @@ class BlenderCave(base.Base):
             # Here, we are sure that there is only one computer !
             self._master_node = 'localhost'
 
+        # Computer of each screen (by screen ID), where a slave finds its parent inside the relay tree
+        nodes = []
+        for screen in self._screens:
+            if screen._parent._name == '*':
+                nodes.append('localhost')
+            else:
+                nodes.append(screen._parent._name)
+
+        shared_memory = self._synchroSharedMemory
+        if shared_memory is None:
+            # Only worth it when a slave runs on the computer of the master (the other ones fall back to TCP)
+            if self._master_node in nodes[1:]:
+                shared_memory = 16
+            else:
+                shared_memory = 0
+
         try:
             users = []
             for userName, user in self._children['user'].items():
@@ -123,7 +216,21 @@ class BlenderCave(base.Base):
         configuration['computers']  = computers
         configuration['connection'] = {'port'           : self._synchroPort,
                                        'address'        : self._synchroAddress,
+                                       'transport'      : self._synchroTransport,
+                                       'compression'    : self._synchroCompression,
+                                       'protocol'       : self._synchroProtocol,
+                                       'bandwidth'      : self._synchroBandwidth,
+                                       'barrier'        : self._synchroBarrier,
+                                       'barrier_timeout': self._synchroBarrierTimeout,
+                                       'shared_memory'  : shared_memory * 1024 * 1024,
+                                       'relay'          : self._synchroRelay,
+                                       'tree'           : self._synchroTree,
+                                       'datagram'       : (self._synchroTransforms == 'datagram'),
+                                       'nodes'          : nodes,
                                        'number_screens' : len(self._screens),
                                        'master_node'    : self._master_node}
+        configuration['synchronizer'] = {'encoding'  : self._synchroEncoding,
+                                         'smoothing' : self._synchroSmoothing,
+                                         'channel'   : self._synchroTransforms}
 
         return configuration
@@ -62,6 +62,13 @@ class Network(blender_cave.base.Base):
     def isReady(self):
         return self._connector.isReady()
 
+    def getMasterTime(self):
+        """Get the current time of the master clock, to compare timestamps between the nodes"""
+        return self._connector.getMasterTime()
+
+    def getFrameTime(self):
+        return self._connector.getFrameTime()
+
     def quit(self, reason):
         self._connector.quit(reason)
 
@@ -71,6 +78,7 @@ class Network(blender_cave.base.Base):
     def run(self):
         try:
             self._connector.run()
+            self._synchronizer.run()
         except SystemExit:
             pass
         except:
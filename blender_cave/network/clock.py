@@ -0,0 +1,102 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+import time
+import collections
+import blender_cave.base
+
+class Clock(blender_cave.base.Base):
+    """Estimation of the master clock on a slave
+
+    NTP-like : the slave sends its time t0, the master answers with t0, its
+    reception time t1 and its sending time t2, and the slave receives the
+    answer at t3. Then :
+      round trip time = (t3 - t0) - (t2 - t1)
+      offset          = ((t1 - t0) + (t2 - t3)) / 2
+    The samples with the lowest round trip time are the most accurate : the
+    offset is the one of the best sample among the last ones."""
+
+    # Number of samples kept to select the best one
+    WINDOW         = 8
+    # Period between two requests : faster until the window is full
+    PERIOD_STARTUP = 0.1
+    PERIOD         = 1.0
+
+    def __init__(self, parent):
+        super(Clock, self).__init__(parent)
+        self._samples   = collections.deque(maxlen = self.WINDOW)
+        self._offset    = None
+        self._rtt       = None
+        self._next      = 0
+        self._count     = 0
+
+    def needRequest(self):
+        now = time.time()
+        if now < self._next:
+            return False
+        if self._count < self.WINDOW:
+            self._next = now + self.PERIOD_STARTUP
+        else:
+            self._next = now + self.PERIOD
+        return True
+
+    def addSample(self, t0, t1, t2, t3):
+        rtt    = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2.0
+        self._samples.append((rtt, offset))
+        self._count += 1
+        synchronized = self.isSynchronized()
+        self._rtt, self._offset = min(self._samples)
+        if not synchronized:
+            self.getLogger().info('Clock synchronized with the master : offset ' + '%.3f' % (self._offset * 1000) + ' ms, round trip time ' + '%.3f' % (self._rtt * 1000) + ' ms')
+
+    def isSynchronized(self):
+        return self._offset is not None
+
+    def getOffset(self):
+        """Get the difference between the master clock and the local one (0 until the first answer of the master)"""
+        if self._offset is None:
+            return 0.0
+        return self._offset
+
+    def getRoundTripTime(self):
+        return self._rtt
+
+    def getMasterTime(self, local_time = None):
+        """Get the master time corresponding to local_time (default : now)"""
+        if local_time is None:
+            local_time = time.time()
+        return local_time + self.getOffset()
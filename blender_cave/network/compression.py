@@ -0,0 +1,155 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+import time
+import zlib
+import blender_cave.buffer
+import blender_cave.exceptions
+import blender_cave.base
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+class Compression(blender_cave.base.Base):
+    """Optional compression of the synchronizer frames
+
+    Each frame is prefixed by a flag telling how it is compressed. On the
+    master, compression is only used when it is expected to save more time on
+    the link than it costs to compress and uncompress the frame. The estimates
+    are exponential moving averages that are refreshed by probing the
+    compression from time to time, even when it is not worth it."""
+
+    RAW  = 0
+    ZLIB = 1
+    LZ4  = 2
+
+    # Frames smaller than that are never compressed
+    THRESHOLD       = 1024
+    # Uncompressing is considered as costing this part of the compression time
+    UNCOMPRESS_COST = 0.3
+    # Weight of the last measure inside the moving averages
+    SMOOTHING       = 0.2
+    # When compression is not worth it, try it anyway once every PROBE_PERIOD frames
+    PROBE_PERIOD    = 100
+
+    def __init__(self, parent, config):
+        super(Compression, self).__init__(parent)
+        method = config.get('compression', 'none')
+        if (method == 'lz4') and (lz4 is None):
+            self.getLogger().warning('lz4 module not available : using zlib compression')
+            method = 'zlib'
+        if method == 'zlib':
+            self._flag = self.ZLIB
+        elif method == 'lz4':
+            self._flag = self.LZ4
+        else:
+            self._flag = self.RAW
+        # Link bandwidth, in bytes per second
+        self._bandwidth = config.get('bandwidth', 1000) * 1000000.0 / 8.0
+        # Estimates : compression speed (bytes per second) and compressed size ratio
+        self._speed     = None
+        self._ratio     = None
+        self._frames    = 0
+        self._statistics = {'raw'        : 0,
+                            'compressed' : 0,
+                            'input'      : 0,
+                            'output'     : 0}
+
+    def getStatistics(self):
+        return self._statistics
+
+    def pack(self, buffer, frame):
+        """Add frame to buffer, prefixed by its compression flag"""
+        data = frame.getData()
+        flag = self.RAW
+        if self._isWorth(len(data)):
+            start      = time.time()
+            compressed = self._compress(data)
+            duration   = time.time() - start
+            self._update(len(data), len(compressed), duration)
+            if len(compressed) < len(data):
+                flag = self._flag
+                data = compressed
+                self._statistics['compressed'] += 1
+                self._statistics['input']      += len(frame)
+                self._statistics['output']     += len(data)
+        if flag == self.RAW:
+            self._statistics['raw'] += 1
+        buffer.unsigned_char(flag)
+        buffer.subBuffer(blender_cave.buffer.Buffer(data))
+
+    def unpack(self, buffer):
+        """Read a frame written by pack"""
+        flag = buffer.unsigned_char()
+        data = buffer.subBuffer()
+        if flag == self.RAW:
+            return data
+        if flag == self.ZLIB:
+            return blender_cave.buffer.Buffer(zlib.decompress(data.getData()))
+        if (flag == self.LZ4) and (lz4 is not None):
+            return blender_cave.buffer.Buffer(lz4.frame.decompress(data.getData()))
+        raise blender_cave.exceptions.Controller("Cannot uncompress frame (compression " + str(flag) + ")")
+
+    def _compress(self, data):
+        if self._flag == self.LZ4:
+            return lz4.frame.compress(data)
+        # Lowest level : we are looking for speed, not ratio
+        return zlib.compress(data, 1)
+
+    def _isWorth(self, size):
+        if (self._flag == self.RAW) or (size < self.THRESHOLD):
+            return False
+        if self._speed is None:
+            return True
+        self._frames += 1
+        if self._frames >= self.PROBE_PERIOD:
+            self._frames = 0
+            return True
+        cost   = (1.0 + self.UNCOMPRESS_COST) * size / self._speed
+        saving = size * (1.0 - self._ratio) / self._bandwidth
+        return saving > cost
+
+    def _update(self, size, compressed_size, duration):
+        speed = size / max(duration, 1e-6)
+        ratio = float(compressed_size) / size
+        if self._speed is None:
+            self._speed = speed
+            self._ratio = ratio
+        else:
+            self._speed += self.SMOOTHING * (speed - self._speed)
+            self._ratio += self.SMOOTHING * (ratio - self._ratio)
@@ -33,71 +33,100 @@
 ## knowledge of the CeCILL license and that you accept its terms.
 ## 
 
+import time
+import errno
 import struct
 import socket
 import blender_cave.buffer
 import blender_cave.exceptions
 import blender_cave.base
+from .peer import Peer
+from .peer import receiveHello
 
 class Base(blender_cave.base.Base):
 
-    BUFFER_SIZE = 4096
-    SIZE_FORMAT = '>i'
-    # Beware: we limit to 256 nodes
-    ID_FORMAT   = 'B'
+    # First message of a slave : its screen ID (beware: we limit to 65536 nodes) and its highest protocol version
+    HELLO_FORMAT = '>HB'
 
     # Controller status
     STATUS_WAIT_FOR_CONNECTION = 0
     STATUS_READY               = 1
 
+    # Transport of the synchronizer frames
+    TRANSPORT_TCP       = 'tcp'
+    TRANSPORT_MULTICAST = 'multicast'
+
     # Protocol from master to slaves
     SYNCHRONIZER   = b'S'
+    # Frame without any change : only the master time and the frame counter
+    HEARTBEAT      = b'e'
     EVERYBODY_HERE = b'c'
     QUIT           = b'q'
+    RETRANSMIT     = b'r'
+    SNAPSHOT       = b'j'
+    BARRIER        = b'w'
+    RELEASE        = b'g'
+    PONG           = b'o'
+    # Encoding of the next messages : first answer to the connection of a slave
+    VERSION        = b'v'
+    # Both ways : the slave asks to read the frames from the shared memory, the master tells from which frame
+    SHARED         = b'h'
+    # Both ways : a slave relays another screen of its computer, the master answers with the messages to join
+    RELAY          = b'l'
+
+    # Protocol from slaves to master
+    NACK           = b'n'
+    ACKNOWLEDGE    = b'k'
+    PING           = b'p'
+    # Datagram channel : UDP port of the slave, last frame received (baseline of the next ones)
+    DATAGRAM       = b'd'
+    BASELINE       = b'b'
 
-    def __init__(self, parent, synchronizer):
+    def __init__(self, parent, config, synchronizer):
         super(Base, self).__init__(parent)
         self._status = self.STATUS_WAIT_FOR_CONNECTION
 
         self._synchronizer = synchronizer
+        self._multicast    = None
+        self._shared       = None
+        self._datagram     = None
+        self._transport    = config.get('transport', self.TRANSPORT_TCP)
+        self._protocol     = config.get('protocol', blender_cave.buffer.PROTOCOL)
+        # Swap-lock : every node waits for the others before rendering the frame
+        self._barrier         = config.get('barrier', False)
+        self._barrier_timeout = config.get('barrier_timeout', 50) / 1000.0
 
         from . import select
         self._select = select.Select(self)
 
-    def _receiveFrom(self, client):
-        try:
-            whole_size = client.recv(struct.calcsize(self.SIZE_FORMAT))
-            if len(whole_size) < struct.calcsize(self.SIZE_FORMAT):
-                return
-            whole_size = struct.unpack_from(self.SIZE_FORMAT, whole_size)
-            whole_size = whole_size[0]
-            buffer = blender_cave.buffer.Buffer()
-            rcv_size = min(self.BUFFER_SIZE, whole_size - len(buffer))
-            while rcv_size > 0:
-                data = client.recv(rcv_size)
-                if not data:
-                    return
-                buffer._buffer += data
-                rcv_size = min(self.BUFFER_SIZE, whole_size - len(buffer))
-            return buffer
-        except socket.error:
-            return
+        from . import compression
+        self._compression = compression.Compression(self, config)
 
     def _send(self, buffer):
-        buffer = buffer._buffer
-        size = len(buffer)
-        self._sendPartialBinary(struct.pack(self.SIZE_FORMAT, size))
-        size = min(self.BUFFER_SIZE, len(buffer))
-        while size > 0:
-            self._sendPartialBinary(buffer[:size])
-            buffer = buffer[size:]
-            size = min(self.BUFFER_SIZE, len(buffer))
-        
-    def _sendBinaryTo(self, peer, buffer):
-        try:
-            peer.send(buffer)
-        except socket.error:
+        for peer in self._getPeers():
+            self._sendTo(peer, buffer)
+
+    def _sendTo(self, peer, buffer):
+        if not peer.send(buffer.getData()):
+            self._lostPeer(peer)
             return
+        self._updateWriter(peer)
+
+    def _flushPeer(self, peer_socket):
+        peer = self._getPeer(peer_socket)
+        if peer is None:
+            self._select.setWriter(peer_socket, None)
+            return
+        if not peer.flush():
+            self._lostPeer(peer)
+            return
+        self._updateWriter(peer)
+
+    def _updateWriter(self, peer):
+        if peer.hasPendingOutput():
+            self._select.setWriter(peer.getSocket(), self._flushPeer)
+        else:
+            self._select.setWriter(peer.getSocket(), None)
 
     def _sendCommand(self, command):
         buffer = blender_cave.buffer.Buffer()
@@ -112,6 +141,7 @@ class Base(blender_cave.base.Base):
                 pass                
             try:
                 self._select.setClient(self._socket, None)
+                self._select.setWriter(self._socket, None)
             except:
                 pass
             self._socket.close()
@@ -130,13 +160,56 @@ class Base(blender_cave.base.Base):
     def isReady(self):
         return self._status == self.STATUS_READY
 
+    def getMasterTime(self):
+        """Get the current time of the master clock"""
+        return time.time()
+
+    def getFrameTime(self):
+        return None
+
 class Master(Base):
 
+    # Period of the report of the barrier wait of each client (seconds)
+    BARRIER_REPORT_PERIOD = 10.0
+    # Period of the report of the output of each client (seconds)
+    OUTPUT_REPORT_PERIOD  = 10.0
+    # Maximum wait for the clients to close their connection when quitting (seconds)
+    QUIT_TIMEOUT          = 2.0
+
     def __init__(self, parent, config, synchronizer):
-        super(Master, self).__init__(parent, synchronizer)
+        super(Master, self).__init__(parent, config, synchronizer)
+
+        self._number_slaves  = config['number_screens'] - 1
+        self._clients        = {}
+        self._identifying    = {}
+        self._shared_token   = None
+        self._output_report  = time.time()
+        self._frame           = 0
+        self._barrier_start   = 0
+        self._barrier_pending = set()
+        self._barrier_report  = time.time()
 
-        self._number_slaves = config['number_screens'] - 1
-        self._clients       = {}
+        # The same frames are sent to all the slaves : they must all use the version of the master
+        blender_cave.buffer.setProtocol(self._protocol)
+
+        if self._transport == self.TRANSPORT_MULTICAST:
+            from . import multicast
+            self._multicast = multicast.Sender(self, config)
+            self.getLogger().info('Synchronizer frames sent to multicast group ' + config['address'] + ':' + str(config['port']))
+        elif (config.get('shared_memory', 0) > 0) and (config.get('tree', 0) == 0):
+            # The slaves running on this computer will read the frames from there
+            from . import shared
+            try:
+                self._shared = shared.Sender(self, config)
+            except (IOError, OSError) as error:
+                self.getLogger().warning('Cannot create the shared memory : ' + str(error))
+            else:
+                self._shared_token = self._shared.getToken()
+
+        if config.get('datagram', False):
+            # The transformations are sent apart, without retransmission
+            from . import datagram
+            self._datagram = datagram.Sender(self, config)
 
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._socket.bind(('', config['port']))
@@ -147,138 +220,866 @@ class Master(Base):
 
     def run(self):
         if self.isReady():
+            self._frame += 1
+            frame_time = time.time()
+            frame  = self._synchronizer.getBuffer()
             buffer = blender_cave.buffer.Buffer()
-            buffer.command(self.SYNCHRONIZER)
-            buffer.subBuffer(self._synchronizer.getBuffer())
-            self._send(buffer)
+            if frame.isEmpty():
+                # Static scene : the slaves have nothing to parse
+                buffer.command(self.HEARTBEAT)
+                buffer.double(frame_time)
+                buffer.integer(self._frame)
+            else:
+                buffer.command(self.SYNCHRONIZER)
+                buffer.double(frame_time)
+                self._compression.pack(buffer, frame)
+            if self._barrier:
+                # Inside the frame : whatever the transport, it is acknowledged once applied
+                buffer.command(self.BARRIER)
+                buffer.integer(self._frame)
+            if self._multicast is not None:
+                self._multicast.send(buffer)
+            else:
+                if (self._shared is not None) and (not self._shared.send(buffer)):
+                    self._closeShared()
+                for client in list(self._clients.values()):
+                    if not client['shared']:
+                        self._sendFrameTo(client, buffer)
+            if self._datagram is not None:
+                self._sendDatagram(frame_time)
+            if self._barrier:
+                self._waitBarrier()
+            if time.time() - self._output_report > self.OUTPUT_REPORT_PERIOD:
+                self._reportOutput()
         self._select.run(False)
 
+    def _sendFrameTo(self, client, buffer):
+        """Send the frame to a client, unless it is too slow
+
+        Never wait for a slow client, nor slow down the other ones : it misses
+        the next frames, then gets a snapshot of the state once it caught up"""
+        peer = client['peer']
+        if client['behind'] > 0:
+            if not peer.isDrained():
+                client['skipped'] += 1
+                return
+            self.getLogger().info('Client [' + str(client['id']) + '] ' + client['address'] + ' caught up after ' + str(self._frame - client['behind']) + ' skipped frames : sending a snapshot')
+            client['behind'] = 0
+            self._resynchronizeScreens(client)
+            return
+        if peer.isOverloaded():
+            client['behind']   = self._frame
+            client['skipped'] += 1
+            self.getLogger().warning('Client [' + str(client['id']) + '] ' + client['address'] + ' is too slow (' + str(peer.getPending()) + ' bytes pending) : skipping its frames')
+            return
+        self._sendTo(peer, buffer)
+
+    def _resynchronizeScreens(self, client):
+        # The snapshot holds the last frame : acknowledged as such when the barrier is on
+        snapshot = blender_cave.buffer.Buffer()
+        self._addSnapshot(snapshot)
+        if self._barrier:
+            snapshot.command(self.BARRIER)
+            snapshot.integer(self._frame)
+        client['resynchronizations'] += 1
+        self._sendTo(client['peer'], snapshot)
+        # The relays never forward the snapshots : each screen it relays gets its own one
+        for screen_id in client['screens'][1:]:
+            answer = blender_cave.buffer.Buffer()
+            answer.command(self.RELAY)
+            answer.integer(screen_id)
+            answer.subBuffer(snapshot)
+            self._sendTo(client['peer'], answer)
+
+    def getOutputStatistics(self):
+        """Get, for each client ID, the counters of its connection (messages, bytes, system calls, partial writes,
+        maximum pending bytes) and of the frames it missed as too slow"""
+        statistics = {}
+        for client in self._clients.values():
+            output = dict(client['peer'].getStatistics())
+            output['pending']            = client['peer'].getPending()
+            output['skipped']            = client['skipped']
+            output['resynchronizations'] = client['resynchronizations']
+            statistics[client['id']] = output
+        return statistics
+
+    def _reportOutput(self):
+        statistics = self.getOutputStatistics()
+        for client in sorted(self._clients.values(), key = lambda client: client['id']):
+            output = statistics[client['id']]
+            self.getLogger().info('Output to client [' + str(client['id']) + '] ' + client['address'] + ' : ' + str(output['messages']) + ' messages, ' + str(output['bytes']) + ' bytes, ' + str(output['syscalls']) + ' system calls, ' + str(output['partial']) + ' partial writes, ' + str(output['pending']) + ' bytes pending (max ' + str(output['max_pending']) + '), ' + str(output['skipped']) + ' frames skipped, ' + str(output['resynchronizations']) + ' snapshots')
+        self._output_report = time.time()
+
+    def _sendDatagram(self, frame_time):
+        # Relative to the last frame that every client received
+        baselines = [client['baseline'] for client in self._clients.values()]
+        if len(baselines) > 0:
+            baseline = min(baselines)
+        else:
+            baseline = 0
+        buffer = blender_cave.buffer.Buffer()
+        buffer.double(frame_time)
+        buffer += self._synchronizer.getDatagramBuffer(self._frame, baseline)
+        self._datagram.send(self._frame, buffer)
+
+    def _waitBarrier(self):
+        """Wait for all the clients to acknowledge the current frame (or the timeout) before releasing them"""
+        self._barrier_start   = time.time()
+        # The clients too slow to get this frame cannot acknowledge it
+        self._barrier_pending = set(client_socket for client_socket, client in self._clients.items() if client['behind'] == 0)
+        deadline = self._barrier_start + self._barrier_timeout
+        while len(self._barrier_pending) > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self._select.run(True, remaining)
+        for client_socket in self._barrier_pending:
+            if client_socket in self._clients:
+                self._clients[client_socket]['barrier']['timeouts'] += 1
+        self._barrier_pending = set()
+        buffer = blender_cave.buffer.Buffer()
+        buffer.command(self.RELEASE)
+        buffer.integer(self._frame)
+        self._send(buffer)
+        if time.time() - self._barrier_report > self.BARRIER_REPORT_PERIOD:
+            self._reportBarrier()
+
+    def _acknowledge(self, client_socket, buffer):
+        frame = buffer.integer()
+        if (frame != self._frame) or (client_socket not in self._barrier_pending):
+            return
+        self._barrier_pending.discard(client_socket)
+        wait       = time.time() - self._barrier_start
+        statistics = self._clients[client_socket]['barrier']
+        statistics['frames'] += 1
+        statistics['total']  += wait
+        statistics['max']     = max(statistics['max'], wait)
+
+    def getBarrierStatistics(self):
+        """Get, for each client ID, the time spent by the master waiting for its acknowledgements since the last report"""
+        return dict((client['id'], client['barrier']) for client in self._clients.values())
+
+    def _reportBarrier(self):
+        slowest = None
+        for client in sorted(self._clients.values(), key = lambda client: client['id']):
+            statistics = client['barrier']
+            if statistics['frames'] > 0:
+                mean = statistics['total'] / statistics['frames']
+            else:
+                mean = 0.0
+            self.getLogger().info('Barrier wait of client [' + str(client['id']) + '] ' + client['address'] + ' : mean ' + '%.2f' % (mean * 1000) + ' ms, max ' + '%.2f' % (statistics['max'] * 1000) + ' ms, ' + str(statistics['timeouts']) + ' timeouts')
+            if (slowest is None) or ((statistics['timeouts'], mean) > slowest[0]):
+                slowest = ((statistics['timeouts'], mean), client)
+        if slowest is not None:
+            self.getLogger().info('Slowest client : [' + str(slowest[1]['id']) + '] ' + slowest[1]['address'])
+        for client in self._clients.values():
+            client['barrier'] = self._newBarrierStatistics()
+        self._barrier_report = time.time()
+
+    def _newBarrierStatistics(self):
+        return {'frames'   : 0,
+                'total'    : 0.0,
+                'max'      : 0.0,
+                'timeouts' : 0}
+
+    def _getPeers(self):
+        return [client['peer'] for client in list(self._clients.values())]
+
+    def _getPeer(self, peer_socket):
+        try:
+            return self._clients[peer_socket]['peer']
+        except KeyError:
+            return None
+
+    def _lostPeer(self, peer):
+        self._delClient(peer.getSocket())
+
     def _connectClient(self, server):
-        if server == self._socket:
+        if server != self._socket:
+            return
+        try:
             client_socket, address = self._socket.accept()
-            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            try:
-                client_id = struct.unpack_from(self.ID_FORMAT, client_socket.recv(struct.calcsize(self.ID_FORMAT)))
-                client_id = client_id[0]
-            except socket.error:
-                raise blender_cave.exceptions.Controller("Protocol error : client don't send correct connection message !")
-            self.getLogger().info("Main Connection of a client [" + str(client_id) + "] : " + str(address))
-            self._addClient(client_id, client_socket, str(address))
+        except socket.error:
+            return
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Never wait for the ID of the client inside the rendering loop
+        client_socket.setblocking(False)
+        self._identifying[client_socket] = (address, bytearray())
+        self._select.setClient(client_socket, self._identifyClient)
+
+    def _identifyClient(self, client_socket):
+        address, hello = self._identifying[client_socket]
+        size = struct.calcsize(self.HELLO_FORMAT)
+        if not receiveHello(client_socket, hello, size):
+            # Restarted or crashed before saying who it is : it will connect again
+            self.getLogger().warning("Connection of a client " + str(address) + " closed before its connection message")
+            del(self._identifying[client_socket])
+            self._select.setClient(client_socket, None)
+            client_socket.close()
+            return
+        if len(hello) < size:
+            # Wait for the rest of the message
+            return
+        del(self._identifying[client_socket])
+        self._select.setClient(client_socket, None)
+        client_id, protocol = struct.unpack_from(self.HELLO_FORMAT, hello)
+        version = self._getVersionBuffer()
+        if protocol < self._protocol:
+            # Told anyway, so the client quits instead of trying to connect again
+            self.getLogger().error("Client [" + str(client_id) + "] only supports the protocol version " + str(protocol) + " : master uses version " + str(self._protocol))
+            Peer(self, client_socket, str(address)).send(version.getData())
+            client_socket.close()
+            return
+        self.getLogger().info("Main Connection of a client [" + str(client_id) + "] : " + str(address))
+        self._addClient(client_id, client_socket, str(address))
+        self._sendTo(self._clients[client_socket]['peer'], version)
+        if self.isReady():
+            self._joinClient(client_socket)
+        else:
             self._check_everybody_connected()
 
     def _addClient(self, client_id, client_socket, address):
-        for index, client in self._clients.items():
-            if client['id'] == client_id:
-                raise blender_cave.exceptions.Controller("Protocol error : client already defined !")
+        self._dropScreen(client_id)
         self._clients[client_socket] = {'id'      : client_id,
                                         'socket'  : client_socket,
-                                        'address' : address}
+                                        'address' : address,
+                                        'peer'    : Peer(self, client_socket, address),
+                                        'barrier' : self._newBarrierStatistics(),
+                                        'shared'  : False,
+                                        # The screens this client represents : itself and the ones it relays
+                                        'screens' : [client_id],
+                                        # Last datagram frame received
+                                        'baseline': 0,
+                                        # Multicast frame from which the last snapshot sent to resynchronize it applies
+                                        'resynchronized' : 0,
+                                        # First frame it missed as too slow (0 : it gets the frames), frames missed
+                                        # and snapshots sent once it caught up
+                                        'behind'         : 0,
+                                        'skipped'        : 0,
+                                        'resynchronizations' : 0}
         self._select.setClient(client_socket, self._processMessageFromClient)
 
+    def _getVersionBuffer(self):
+        # Independent of the protocol version
+        buffer = blender_cave.buffer.Buffer()
+        buffer.command(self.VERSION)
+        buffer.unsigned_char(self._protocol)
+        return buffer
+
+    def _dropScreen(self, screen_id):
+        for index, client in list(self._clients.items()):
+            if screen_id in client['screens']:
+                if not self.isReady():
+                    raise blender_cave.exceptions.Controller("Protocol error : client already defined !")
+                # The previous connection of a restarted client may not be detected as lost yet
+                if client['id'] == screen_id:
+                    self.getLogger().warning("Client [" + str(screen_id) + "] reconnects : drop its previous connection (" + client['address'] + ")")
+                    self._removeClient(index)
+                else:
+                    self.getLogger().warning("Client [" + str(screen_id) + "] reconnects : drop its previous relay by client [" + str(client['id']) + "]")
+                    client['screens'].remove(screen_id)
+
+    def _relayClient(self, client_socket, buffer):
+        screen_id = buffer.integer()
+        connected = buffer.boolean()
+        client    = self._clients[client_socket]
+        if not connected:
+            if screen_id in client['screens']:
+                client['screens'].remove(screen_id)
+            self.getLogger().warning("Lose connection to client [" + str(screen_id) + "] relayed by client [" + str(client['id']) + "]")
+            return
+        self._dropScreen(screen_id)
+        client['screens'].append(screen_id)
+        self.getLogger().info("Connection of a client [" + str(screen_id) + "] relayed by client [" + str(client['id']) + "]")
+        answer = blender_cave.buffer.Buffer()
+        answer.command(self.RELAY)
+        answer.integer(screen_id)
+        joining = self._getVersionBuffer()
+        if self.isReady():
+            self._addSnapshot(joining)
+            joining.command(self.EVERYBODY_HERE)
+        answer.subBuffer(joining)
+        self._sendTo(client['peer'], answer)
+        self._check_everybody_connected()
+
     def _delClient(self, client_socket):
         if client_socket in self._clients:
             msg = "Lose connection to client \"" + self._clients[client_socket]['address'] + "\""
-            del(self._clients[client_socket])
-            self._select.setClient(client_socket, None)
+            self.getLogger().debug('Compression statistics : ' + str(self._compression.getStatistics()))
+            self._removeClient(client_socket)
         else:
             msg = "Lose connection to an unknown client"
+        if self.isReady() and not hasattr(self, '_is_quitting'):
+            # The simulation goes on : the client can join it again
+            self.getLogger().warning(msg + " : waiting for it to join again")
+            return
         self.quit(msg)
 
+    def _removeClient(self, client_socket):
+        self.getLogger().debug('Output statistics of client ' + self._clients[client_socket]['address'] + ' : ' + str(self._clients[client_socket]['peer'].getStatistics()))
+        self.getLogger().debug('Barrier statistics of client ' + self._clients[client_socket]['address'] + ' : ' + str(self._clients[client_socket]['barrier']))
+        del(self._clients[client_socket])
+        self._barrier_pending.discard(client_socket)
+        if self._datagram is not None:
+            self._datagram.setTarget(client_socket, None)
+        self._select.setClient(client_socket, None)
+        self._select.setWriter(client_socket, None)
+        try:
+            client_socket.close()
+        except socket.error:
+            pass
+
+    def _joinClient(self, client_socket):
+        """Bring a client that (re)connects during the simulation up to date
+
+        It receives a snapshot of the current state of the synchronizer, followed by the frames sent to everybody"""
+        client   = self._clients[client_socket]
+        snapshot = blender_cave.buffer.Buffer()
+        self._addSnapshot(snapshot)
+        snapshot.command(self.EVERYBODY_HERE)
+        self.getLogger().info("Client [" + str(client['id']) + "] joins the simulation : sending a snapshot of " + str(len(snapshot)) + " bytes")
+        self._sendTo(client['peer'], snapshot)
+
+    def _addSnapshot(self, buffer):
+        buffer.command(self.SNAPSHOT)
+        if self._multicast is not None:
+            buffer.integer(self._multicast.getSequence())
+        self._compression.pack(buffer, self._synchronizer.getSnapshotBuffer())
+
+    def _shareClient(self, client_socket, buffer):
+        token  = buffer.integer()
+        client = self._clients[client_socket]
+        if token != self._shared_token:
+            # This is the shared memory of another master
+            return
+        answer = blender_cave.buffer.Buffer()
+        if self._shared is None:
+            # Overrun just before the shared memory has been closed : the client still lost frames
+            self._addSnapshot(answer)
+            self._sendTo(client['peer'], answer)
+            return
+        answer.command(self.SHARED)
+        answer.integer(self._shared.getSequence())
+        if client['shared']:
+            # The client has been overrun : it lost frames
+            self.getLogger().warning("Client [" + str(client['id']) + "] has been overrun inside the shared memory : sending a snapshot")
+            self._addSnapshot(answer)
+        else:
+            self.getLogger().info("Client [" + str(client['id']) + "] reads the frames from the shared memory")
+        client['shared'] = True
+        self._sendTo(client['peer'], answer)
+
+    def _closeShared(self):
+        # The current frame does not fit inside the shared memory : from now, the frames are sent by TCP to everybody
+        self.getLogger().warning('Frame too big for the shared memory : stop using it')
+        answer = blender_cave.buffer.Buffer()
+        answer.command(self.SHARED)
+        answer.integer(-1)
+        for client in list(self._clients.values()):
+            if client['shared']:
+                client['shared'] = False
+                self._sendTo(client['peer'], answer)
+        self._shared.close()
+        self._shared = None
+
     def _processMessageFromClient(self, peer): 
-        buffer = self._receiveFrom(peer)
-        if buffer is None:
+        buffers = self._clients[peer]['peer'].receive()
+        if buffers is None:
             self._delClient(peer)
             return
-        while not buffer.isEmpty():
-            command = buffer.command()
-            if command == self.QUIT:
-                reason = buffer.string()
-                self.quit(reason)
-            else:
-                raise blender_cave.exceptions.Controller("Unattended command (" + str(command) + ") from " + self._clients[peer]['address'])
+        for buffer in buffers:
+            while not buffer.isEmpty():
+                command = buffer.command()
+                if command == self.QUIT:
+                    reason = buffer.string()
+                    self.quit(reason)
+                elif command == self.NACK:
+                    self._retransmit(peer, buffer)
+                elif command == self.ACKNOWLEDGE:
+                    self._acknowledge(peer, buffer)
+                elif command == self.SHARED:
+                    self._shareClient(peer, buffer)
+                elif command == self.RELAY:
+                    self._relayClient(peer, buffer)
+                elif command == self.DATAGRAM:
+                    port = buffer.integer()
+                    if self._datagram is not None:
+                        self._datagram.setTarget(peer, (peer.getpeername()[0], port))
+                elif command == self.BASELINE:
+                    client = self._clients[peer]
+                    client['baseline'] = max(client['baseline'], buffer.integer())
+                elif command == self.PING:
+                    received = time.time()
+                    pong = blender_cave.buffer.Buffer()
+                    pong.command(self.PONG)
+                    pong.double(buffer.double())
+                    pong.double(received)
+                    pong.double(time.time())
+                    self._sendTo(self._clients[peer]['peer'], pong)
+                else:
+                    raise blender_cave.exceptions.Controller("Unattended command (" + str(command) + ") from " + self._clients[peer]['address'])
+
+    def _retransmit(self, peer, buffer):
+        sequence = buffer.integer()
+        indexes  = [buffer.integer() for index in range(buffer.size())]
+        datagrams = self._multicast.getDatagrams(sequence, indexes)
+        if datagrams is None:
+            self._resynchronize(peer, sequence)
+            return
+        retransmission = blender_cave.buffer.Buffer()
+        for datagram in datagrams:
+            retransmission.command(self.RETRANSMIT)
+            retransmission.subBuffer(blender_cave.buffer.Buffer(datagram))
+        self._sendTo(self._clients[peer]['peer'], retransmission)
+
+    def _resynchronize(self, client_socket, sequence):
+        # The frame left the history (slow or paused client) : the client starts again from a snapshot, as when it joins
+        client = self._clients[client_socket]
+        if sequence < client['resynchronized']:
+            # Already inside the snapshot sent to this client
+            return
+        self.getLogger().warning("Frame " + str(sequence) + " requested by client [" + str(client['id']) + "] " + client['address'] + " is not available anymore : sending a snapshot")
+        snapshot = blender_cave.buffer.Buffer()
+        self._addSnapshot(snapshot)
+        client['resynchronized'] = self._multicast.getSequence()
+        self._sendTo(client['peer'], snapshot)
 
     def _check_everybody_connected(self):
-        if (self._socket is not None) and (len(self._clients) == self._number_slaves):
-            self._shutdown()
+        if (not self.isReady()) and (sum(len(client['screens']) for client in self._clients.values()) == self._number_slaves):
+            # Keep listening : a restarted client can join the simulation again
             self._sendCommand(self.EVERYBODY_HERE)
             self._switchToReady()
 
-    def _sendPartialBinary(self, buffer):
-        for client_socket in self._clients:
-            self._sendBinaryTo(client_socket, buffer)
-
     def start(self):
         self._check_everybody_connected()
 
     def quit(self, reason):
         if not hasattr(self,'_is_quitting'): 
             self._is_quitting = True
+            self._shutdown()
+            if self._shared is not None:
+                self._shared.close()
+                self._shared = None
+            if self._datagram is not None:
+                self._datagram.close()
+                self._datagram = None
             buffer = blender_cave.buffer.Buffer()
             buffer.command(self.QUIT)
             buffer.string(reason)
             self._send(buffer)
+            deadline = time.time() + self.QUIT_TIMEOUT
             while len(self._clients) > 0:
-                self._select.run(True)
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.getLogger().warning(str(len(self._clients)) + " clients did not close their connection")
+                    for client_socket in list(self._clients.keys()):
+                        self._removeClient(client_socket)
+                    break
+                self._select.run(True, remaining)
             super(Master, self).quit(reason)
 
 class Slave(Base):
 
+    # Delays between two attempts to connect to the master (seconds)
+    CONNECT_DELAY_MIN = 0.1
+    CONNECT_DELAY_MAX = 2.0
+    # The master releases the frame at most after its barrier timeout : wait for the release twice as long
+    BARRIER_RELEASE_FACTOR = 2.0
+
     def __init__(self, parent, config, synchronizer):
-        super(Slave, self).__init__(parent, synchronizer)
+        super(Slave, self).__init__(parent, config, synchronizer)
 
         self._port    = config['port']
         self._master  = config['master_node']
         self._slaveID = config['screen_id']
+        self._socket  = None
+        self._peer    = None
+        self._address = None
+        self._retry   = 0
+        self._delay   = self.CONNECT_DELAY_MIN
+        self._barrier_frame  = 0
+        self._released_frame = 0
+        self._relay          = None
+        # Configuration of the shared memory, if the master may publish the frames there
+        self._shared_config  = None
+
+        from . import clock
+        self._clock      = clock.Clock(self)
+        self._frame_time = None
+        # Frame counter of the last heartbeat (frame without change) of the master
+        self._heartbeat  = 0
+        self._latency    = self._newLatencyStatistics()
+        # Frames received but not applied yet : merged when several are available
+        self._frames     = []
+        # Heartbeat received after them : nothing moves anymore once they are applied
+        self._settle     = False
+
+        if self._transport == self.TRANSPORT_MULTICAST:
+            # Join the group before connecting, so we cannot miss the first frame
+            from . import multicast
+            self._multicast = multicast.Receiver(self, config)
+            self._select.setClient(self._multicast.getSocket(), self._processMulticast)
+        elif config.get('tree', 0) > 0:
+            self._joinTree(config)
+        else:
+            if config.get('shared_memory', 0) > 0:
+                self._shared_config = config
+                self._openShared()
+            if config.get('relay', False) and (self._shared is None):
+                from . import relay
+                try:
+                    self._relay = relay.Relay(self, config, self._select, ('127.0.0.1', self._port + 1))
+                except socket.error:
+                    # Another screen of this computer is already connected to the master
+                    self._master = '127.0.0.1'
+                    self._port   = self._port + 1
+                    self.getLogger().info('Connection to the master through the relay of this computer')
+                else:
+                    self.getLogger().info('Relay of the master for the other screens of this computer')
+
+        if config.get('datagram', False):
+            from . import datagram
+            self._datagram = datagram.Receiver(self, config)
+            self._select.setClient(self._datagram.getSocket(), self._processDatagrams)
 
         self.run = self._connectToMaster
 
+    def _joinTree(self, config):
+        # Screen i receives the frames from screen (i - 1) / k (the master is screen 0) and
+        # relays them to the screens k * i + 1 to k * i + k, listening on the port of the master + 1 + i
+        arity = config['tree']
+        port  = config['port']
+        upstream = (self._slaveID - 1) // arity
+        if upstream > 0:
+            self._master = config['nodes'][upstream]
+            self._port   = port + 1 + upstream
+            self.getLogger().info('Connection to the master through the relay of screen [' + str(upstream) + ']')
+        if arity * self._slaveID + 1 < config['number_screens']:
+            from . import relay
+            try:
+                self._relay = relay.Relay(self, config, self._select, ('', port + 1 + self._slaveID))
+            except socket.error as error:
+                raise blender_cave.exceptions.Controller('Cannot open the relay port ' + str(port + 1 + self._slaveID) + ' : ' + str(error))
+            self.getLogger().info('Relay of the master for the screens ' + str(arity * self._slaveID + 1) + ' to ' + str(min(arity * self._slaveID + arity, config['number_screens'] - 1)))
+
     def _connectToMaster(self):
         self._select.run(False)
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if (self._socket is not None) or (time.time() < self._retry):
+            # Connection in progress, or wait before trying again
+            return
 
         try:
-            self._socket.connect((self._master, self._port))
+            if self._address is None:
+                self._address = (socket.gethostbyname(self._master), self._port)
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setblocking(False)
+            error = self._socket.connect_ex(self._address)
         except socket.error as error:
-            del(self._socket)
-            self._socket = None
+            self._connectionFailed(error)
             return
+        if error == 0:
+            self._connected()
+        elif error in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            self._select.setWriter(self._socket, self._checkConnection)
+        else:
+            self._connectionFailed(error)
+
+    def _checkConnection(self, peer):
+        self._select.setWriter(self._socket, None)
+        error = self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error == 0:
+            self._connected()
+        else:
+            self._connectionFailed(error)
+
+    def _connectionFailed(self, error):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self.getLogger().debug('Cannot connect to the master (' + str(error) + ') : try again in ' + str(self._delay) + ' seconds')
+        # Exponential backoff, not to flood a master that is not started yet
+        self._retry = time.time() + self._delay
+        self._delay = min(self._delay * 2, self.CONNECT_DELAY_MAX)
+
+    def _connected(self):
         self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # improve speed ...
 
         # ... and notify the server of who I am ..
         try:
-            self._socket.send((struct.pack(self.ID_FORMAT, self._slaveID)))
+            self._socket.send((struct.pack(self.HELLO_FORMAT, self._slaveID, self._protocol)))
         except socket.error:
             pass
 
         # ... add the socket to the select
+        self._peer = Peer(self, self._socket, self._master + ':' + str(self._port))
         self._select.setClient(self._socket, self._processMessageFromMaster)
 
         self.run = self._run
 
         self.getLogger().info('Connected to master, waiting everybody connected !')
 
+        if (self._shared is None) and (self._shared_config is not None) and (self._relay is None) and (self._port == self._shared_config['port']):
+            # Started before the master : its shared memory exists now that it accepts the connections
+            self._openShared()
+        if self._shared is not None:
+            self._askShared()
+        if (self._datagram is not None) and (self._transport != self.TRANSPORT_MULTICAST):
+            request = blender_cave.buffer.Buffer()
+            request.command(self.DATAGRAM)
+            request.integer(self._datagram.getPort())
+            self._send(request)
+        if self._relay is not None:
+            # The screens that connected to the relay before
+            for screen_id in self._relay.getScreens():
+                self._relayScreen(screen_id, True)
+
+    def _relayScreen(self, screen_id, connected):
+        if self._peer is None:
+            # Told to the master once connected
+            return
+        request = blender_cave.buffer.Buffer()
+        request.command(self.RELAY)
+        request.integer(screen_id)
+        request.boolean(connected)
+        self._send(request)
+
+    def _openShared(self):
+        # Only exists if the master runs on this computer
+        from . import shared
+        try:
+            self._shared = shared.Receiver(self, self._shared_config)
+        except (IOError, OSError):
+            self._shared = None
+
+    def _askShared(self):
+        request = blender_cave.buffer.Buffer()
+        request.command(self.SHARED)
+        request.integer(self._shared.getToken())
+        self._send(request)
+
     def _processMessageFromMaster(self, peer):
-        buffer = self._receiveFrom(peer)
-        if buffer is None:
+        buffers = self._peer.receive()
+        if buffers is None:
             self.quit("Lose connection from the master !")
             return
+        for buffer in buffers:
+            if self._relay is not None:
+                self._relay.forward(buffer)
+            self._processBuffer(buffer, peer)
+        # The buffers are only valid until the next reception
+        self._applyFrames()
+
+    def _processMulticast(self, peer):
+        self._multicast.receive()
+
+    def _processDatagrams(self, peer):
+        self._datagram.receive()
+        if not self.isReady():
+            # Encoded with the protocol version of the master, not known yet
+            return
+        received = self._datagram.getFrame()
+        if received is None:
+            return
+        frame, buffer = received
+        frame_time = buffer.double()
+        if (self._frame_time is None) or (frame_time > self._frame_time):
+            self._frame_time = frame_time
+        if self._synchronizer.processDatagram(frame, buffer):
+            # The master can send the next frames relative to this one
+            baseline = blender_cave.buffer.Buffer()
+            baseline.command(self.BASELINE)
+            baseline.integer(frame)
+            self._send(baseline)
+
+    def _processFrames(self):
+        if self._multicast is not None:
+            self._processMulticastFrames()
+        if (self._shared is not None) and self._shared.isAttached():
+            self._processSharedFrames()
+
+    def _processSharedFrames(self):
+        frames, overrun = self._shared.getFrames()
+        for buffer in frames:
+            self._processBuffer(buffer, 'shared memory')
+        self._applyFrames()
+        if overrun:
+            # Frames are lost : ask the master for a snapshot
+            self.getLogger().warning('Overrun inside the shared memory')
+            self._shared.detach()
+            self._askShared()
+
+    def _processMulticastFrames(self):
+        if not self.isReady():
+            return
+        for buffer in self._multicast.getFrames():
+            self._processBuffer(buffer, self._multicast.getSocket())
+        self._applyFrames()
+        missing = self._multicast.getMissing()
+        if len(missing) > 0:
+            nacks = blender_cave.buffer.Buffer()
+            for sequence, indexes in missing:
+                nacks.command(self.NACK)
+                nacks.integer(sequence)
+                nacks.size(len(indexes))
+                for index in indexes:
+                    nacks.integer(index)
+            self._send(nacks)
+
+    def _applyFrames(self):
+        if len(self._frames) > 0:
+            frames       = self._frames
+            self._frames = []
+            self._synchronizer.processFrames(frames)
+        if self._settle:
+            self._settle = False
+            self._synchronizer.processHeartbeat()
+
+    def _processBuffer(self, buffer, peer):
         while not buffer.isEmpty():
             command = buffer.command()
-            if command == self.EVERYBODY_HERE:
+            if command not in (self.SYNCHRONIZER, self.HEARTBEAT, self.PONG, self.RELEASE, self.RETRANSMIT):
+                # The next messages rely on the frames received before
+                self._applyFrames()
+            if command == self.VERSION:
+                protocol = buffer.unsigned_char()
+                if protocol > self._protocol:
+                    self._shutdown()
+                    self.quit("Protocol version " + str(protocol) + " of the master is not supported (highest : " + str(self._protocol) + ")")
+                    return
+                blender_cave.buffer.setProtocol(protocol)
+            elif command == self.EVERYBODY_HERE:
                 self._switchToReady()
             elif command == self.QUIT:
                 self._shutdown()
                 self.quit(buffer.string())
             elif command == self.SYNCHRONIZER:
-                self._synchronizer.process(buffer.subBuffer())
+                self._setFrameTime(buffer.double())
+                self._frames.append(self._compression.unpack(buffer))
+                self._settle = False
+            elif command == self.HEARTBEAT:
+                self._setFrameTime(buffer.double())
+                self._heartbeat = buffer.integer()
+                self._latency['heartbeats'] += 1
+                self._settle    = True
+            elif command == self.RETRANSMIT:
+                self._multicast.addDatagram(buffer.subBuffer().getData())
+            elif command == self.PONG:
+                t0 = buffer.double()
+                t1 = buffer.double()
+                t2 = buffer.double()
+                self._clock.addSample(t0, t1, t2, time.time())
+            elif command == self.BARRIER:
+                # The frame is applied : ready to render it
+                self._barrier_frame = buffer.integer()
+                if self._relay is not None:
+                    self._relay.acknowledge(self._barrier_frame)
+                else:
+                    self._acknowledge(self._barrier_frame)
+            elif command == self.RELEASE:
+                self._released_frame = max(self._released_frame, buffer.integer())
+            elif command == self.SHARED:
+                sequence = buffer.integer()
+                if sequence < 0:
+                    # The next frames come by TCP : finish the ones inside the shared memory
+                    if self._shared.isAttached():
+                        self._processSharedFrames()
+                    self._shared.close()
+                    self._shared = None
+                else:
+                    self._shared.attach(sequence)
+            elif command == self.RELAY:
+                screen_id = buffer.integer()
+                self._relay.activate(screen_id, buffer.subBuffer())
+            elif command == self.SNAPSHOT:
+                if self._multicast is not None:
+                    self._multicast.setNext(buffer.integer())
+                self._synchronizer.process(self._compression.unpack(buffer))
             else:
                 raise blender_cave.exceptions.Controller("Unattended command (" + str(command) + ") from " + str(peer))
 
+    def _setFrameTime(self, frame_time):
+        self._frame_time = frame_time
+        if self._clock.isSynchronized():
+            latency = self._clock.getMasterTime() - frame_time
+            self._latency['frames'] += 1
+            self._latency['total']  += latency
+            self._latency['max']     = max(self._latency['max'], latency)
+
+    def _acknowledge(self, frame):
+        acknowledge = blender_cave.buffer.Buffer()
+        acknowledge.command(self.ACKNOWLEDGE)
+        acknowledge.integer(frame)
+        self._send(acknowledge)
+
     def _run(self):
+        if self._clock.needRequest():
+            ping = blender_cave.buffer.Buffer()
+            ping.command(self.PING)
+            ping.double(time.time())
+            self._send(ping)
         self._select.run(False)
+        self._processFrames()
+        # Swap-lock : do not render before the master releases the frame
+        deadline = time.time() + self._barrier_timeout * self.BARRIER_RELEASE_FACTOR
+        while self._released_frame < self._barrier_frame:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                # Release lost or master stalled : render anyway rather than freezing the screen
+                self.getLogger().warning('Frame ' + str(self._barrier_frame) + ' not released by the master in time : rendering it anyway')
+                self._released_frame = self._barrier_frame
+                break
+            self._select.run(True, remaining)
+            self._processFrames()
+
+    def getClock(self):
+        return self._clock
+
+    def getMasterTime(self):
+        return self._clock.getMasterTime()
 
-    def _sendPartialBinary(self, buffer):
-        self._sendBinaryTo(self._socket, buffer)
+    def getFrameTime(self):
+        """Get the master time of the last frame applied (None before the first one)"""
+        return self._frame_time
+
+    def getFrameAge(self):
+        """Get how long ago (in seconds) the master sent the last frame applied"""
+        if self._frame_time is None:
+            return None
+        return self._clock.getMasterTime() - self._frame_time
+
+    def getLatencyStatistics(self, reset = False):
+        """Get the statistics of the delay between the sending of the frames by the master and their reception"""
+        statistics = self._latency
+        if reset:
+            self._latency = self._newLatencyStatistics()
+        return statistics
+
+    def _newLatencyStatistics(self):
+        return {'frames'     : 0,
+                'heartbeats' : 0,
+                'total'      : 0.0,
+                'max'        : 0.0}
+
+    def _getPeers(self):
+        if self._peer is None:
+            return []
+        return [self._peer]
+
+    def _getPeer(self, peer_socket):
+        return self._peer
+
+    def _lostPeer(self, peer):
+        self.quit("Lose connection from the master !")
+
+    def quit(self, reason):
+        if self._relay is not None:
+            self._relay.close()
+            self._relay = None
+        if self._datagram is not None:
+            self._select.setClient(self._datagram.getSocket(), None)
+            self._datagram.close()
+            self._datagram = None
+        super(Slave, self).quit(reason)
 
 
 
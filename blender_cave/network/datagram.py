@@ -0,0 +1,180 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+"""Unreliable channel of the synchronizer : UDP datagrams without retransmission
+
+Used for the states that the next frame replaces (ie. : the transformations
+of the objects), so a lost datagram never delays the next ones. Each frame
+is sent with its ID, its content gives its baseline : the frame it is
+relative to. A slave only uses the most recent complete frame and tells the
+master, by TCP, that it can now be used as baseline.
+
+With the multicast transport, the frames are sent once to the multicast group,
+on the next port. Otherwise, they are sent to the port of each slave."""
+
+import socket
+import struct
+import blender_cave.buffer
+import blender_cave.exceptions
+import blender_cave.base
+
+class Base(blender_cave.base.Base):
+
+    # Each datagram starts with : frame ID, fragment index, fragments count
+    HEADER_FORMAT = '>IHH'
+    HEADER_SIZE   = struct.calcsize(HEADER_FORMAT)
+    # Keep the datagrams below ethernet MTU (1500 bytes minus IP and UDP headers)
+    FRAGMENT_SIZE = 1400
+    MAX_FRAGMENTS = 0xFFFF
+
+    def __init__(self, parent, config):
+        super(Base, self).__init__(parent)
+        if config.get('transport') == 'multicast':
+            self._group = (config['address'], config['port'] + 1)
+        else:
+            self._group = None
+
+    def getSocket(self):
+        return self._socket
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+class Sender(Base):
+
+    TTL = 1
+
+    def __init__(self, parent, config):
+        super(Sender, self).__init__(parent, config)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        if self._group is not None:
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.TTL)
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._socket.setblocking(False)
+        self._targets = {}
+
+    def setTarget(self, key, address):
+        """Send the next frames to address (None to stop). Only without multicast"""
+        if address is None:
+            self._targets.pop(key, None)
+        else:
+            self._targets[key] = address
+
+    def send(self, frame, buffer):
+        data  = buffer.getData()
+        count = max(1, (len(data) + self.FRAGMENT_SIZE - 1) // self.FRAGMENT_SIZE)
+        if count > self.MAX_FRAGMENTS:
+            raise blender_cave.exceptions.Controller("Frame too big to be sent by datagrams (" + str(len(data)) + " bytes) !")
+        if self._group is not None:
+            targets = [self._group]
+        else:
+            targets = list(self._targets.values())
+        for index in range(count):
+            offset   = index * self.FRAGMENT_SIZE
+            datagram = struct.pack(self.HEADER_FORMAT, frame, index, count) + data[offset:offset + self.FRAGMENT_SIZE]
+            for target in targets:
+                try:
+                    self._socket.sendto(datagram, target)
+                except socket.error as error:
+                    # Lost, as if the network dropped it : the next frame replaces it
+                    self.getLogger().debug('Cannot send datagram to ' + str(target) + ' : ' + str(error))
+
+class Receiver(Base):
+
+    # Frames older than the most recent one by more than this are not completed anymore
+    WINDOW = 16
+
+    def __init__(self, parent, config):
+        super(Receiver, self).__init__(parent, config)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        if self._group is not None:
+            # Several slaves may listen to the group on the same computer
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket.bind(('', self._group[1]))
+            membership = struct.pack('4sl', socket.inet_aton(self._group[0]), socket.INADDR_ANY)
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        else:
+            self._socket.bind(('', 0))
+        self._socket.setblocking(False)
+
+        self._datagram = bytearray(self.HEADER_SIZE + self.FRAGMENT_SIZE)
+        # Last frame given back : the older ones are useless
+        self._last     = 0
+        self._frames   = {}
+
+    def getPort(self):
+        return self._socket.getsockname()[1]
+
+    def receive(self):
+        view = memoryview(self._datagram)
+        while True:
+            try:
+                size = self._socket.recv_into(self._datagram)
+            except socket.error:
+                return
+            self._addDatagram(view[:size])
+
+    def _addDatagram(self, datagram):
+        if len(datagram) < self.HEADER_SIZE:
+            return
+        frame, index, count = struct.unpack_from(self.HEADER_FORMAT, datagram)
+        if (frame <= self._last) or (index >= count):
+            return
+        try:
+            fragments = self._frames[frame]
+        except KeyError:
+            fragments = [None] * count
+            self._frames[frame] = fragments
+        if fragments[index] is None:
+            fragments[index] = bytes(datagram[self.HEADER_SIZE:])
+
+    def getFrame(self):
+        """Get (frame, buffer) of the most recent complete frame not given yet (None if there is none)"""
+        complete = [frame for frame, fragments in self._frames.items() if None not in fragments]
+        if len(complete) == 0:
+            if len(self._frames) > 0:
+                newest = max(self._frames.keys())
+                for frame in [frame for frame in self._frames if frame < newest - self.WINDOW]:
+                    del(self._frames[frame])
+            return None
+        frame     = max(complete)
+        fragments = self._frames[frame]
+        for old in [old for old in self._frames if old <= frame]:
+            del(self._frames[old])
+        self._last = frame
+        return frame, blender_cave.buffer.Buffer(b''.join(fragments))
@@ -0,0 +1,205 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+import time
+import struct
+import socket
+import collections
+import blender_cave.buffer
+import blender_cave.exceptions
+import blender_cave.base
+
+class Base(blender_cave.base.Base):
+
+    # Each datagram starts with : frame sequence number, fragment index, fragments count
+    HEADER_FORMAT = '>IHH'
+    HEADER_SIZE   = struct.calcsize(HEADER_FORMAT)
+    # Keep the datagrams below ethernet MTU (1500 bytes minus IP and UDP headers)
+    FRAGMENT_SIZE = 1400
+    MAX_FRAGMENTS = 0xFFFF
+
+    def __init__(self, parent, config):
+        super(Base, self).__init__(parent)
+        self._group = (config['address'], config['port'])
+
+    def getSocket(self):
+        return self._socket
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+class Sender(Base):
+
+    # Number of frames kept by the master to answer the NACKs of the slaves
+    HISTORY = 256
+    TTL     = 1
+
+    def __init__(self, parent, config):
+        super(Sender, self).__init__(parent, config)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.TTL)
+        # Slaves may run on the same computer than the master
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._sequence = 0
+        self._history  = collections.OrderedDict()
+
+    def send(self, buffer):
+        data  = buffer.getData()
+        count = max(1, (len(data) + self.FRAGMENT_SIZE - 1) // self.FRAGMENT_SIZE)
+        if count > self.MAX_FRAGMENTS:
+            raise blender_cave.exceptions.Controller("Frame too big to be sent by multicast (" + str(len(data)) + " bytes) !")
+        datagrams = []
+        for index in range(count):
+            offset   = index * self.FRAGMENT_SIZE
+            datagram = struct.pack(self.HEADER_FORMAT, self._sequence, index, count) + data[offset:offset + self.FRAGMENT_SIZE]
+            datagrams.append(datagram)
+            self._sendDatagram(datagram)
+        self._history[self._sequence] = datagrams
+        if len(self._history) > self.HISTORY:
+            self._history.popitem(last = False)
+        self._sequence += 1
+
+    def getSequence(self):
+        """Get the sequence number of the next frame"""
+        return self._sequence
+
+    def getDatagrams(self, sequence, indexes):
+        """Get the datagrams of a previous frame to retransmit them. All of them if indexes is empty"""
+        try:
+            datagrams = self._history[sequence]
+        except KeyError:
+            return None
+        if len(indexes) == 0:
+            return datagrams
+        return [datagrams[index] for index in indexes if index < len(datagrams)]
+
+    def _sendDatagram(self, datagram):
+        try:
+            self._socket.sendto(datagram, self._group)
+        except socket.error as error:
+            # The slaves will ask for this fragment through their NACK
+            self.getLogger().debug('Cannot send multicast datagram : ' + str(error))
+
+class Receiver(Base):
+
+    # Delay before asking again the master for the same missing frame
+    NACK_DELAY = 0.05
+
+    def __init__(self, parent, config):
+        super(Receiver, self).__init__(parent, config)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # Several slaves may listen to the group on the same computer
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('', self._group[1]))
+        membership = struct.pack('4sl', socket.inet_aton(self._group[0]), socket.INADDR_ANY)
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self._socket.setblocking(False)
+
+        self._datagram = bytearray(self.HEADER_SIZE + self.FRAGMENT_SIZE)
+        self._next     = 0
+        self._highest  = -1
+        self._frames   = {}
+        self._nacked   = {}
+
+    def receive(self):
+        view = memoryview(self._datagram)
+        while True:
+            try:
+                size = self._socket.recv_into(self._datagram)
+            except socket.error:
+                return
+            self.addDatagram(view[:size])
+
+    def addDatagram(self, datagram):
+        if len(datagram) < self.HEADER_SIZE:
+            return
+        sequence, index, count = struct.unpack_from(self.HEADER_FORMAT, datagram)
+        if (sequence < self._next) or (index >= count):
+            return
+        try:
+            fragments = self._frames[sequence]
+        except KeyError:
+            fragments = [None] * count
+            self._frames[sequence] = fragments
+        if fragments[index] is None:
+            fragments[index] = bytes(datagram[self.HEADER_SIZE:])
+        if sequence > self._highest:
+            self._highest = sequence
+
+    def setNext(self, sequence):
+        """Start the reception at this frame : the previous ones are already included inside the snapshot sent by the master"""
+        for old in [old for old in self._frames if old < sequence]:
+            del(self._frames[old])
+        for old in [old for old in self._nacked if old < sequence]:
+            del(self._nacked[old])
+        self._next    = sequence
+        self._highest = max(self._highest, sequence - 1)
+
+    def getFrames(self):
+        """Get the frames that are complete, in their sequence order"""
+        frames = []
+        while (self._next in self._frames) and (None not in self._frames[self._next]):
+            fragments = self._frames.pop(self._next)
+            self._nacked.pop(self._next, None)
+            frames.append(blender_cave.buffer.Buffer(b''.join(fragments)))
+            self._next += 1
+        return frames
+
+    def getMissing(self):
+        """Get the list of (sequence, fragment indexes) to ask to the master
+
+        A fragment is considered as lost as soon as a later fragment arrived. An empty indexes list means the whole frame"""
+        missing = []
+        now     = time.time()
+        for sequence in range(self._next, self._highest + 1):
+            if now - self._nacked.get(sequence, 0) < self.NACK_DELAY:
+                continue
+            try:
+                fragments = self._frames[sequence]
+            except KeyError:
+                indexes = []
+            else:
+                if sequence == self._highest:
+                    while (len(fragments) > 0) and (fragments[-1] is None):
+                        fragments = fragments[:-1]
+                indexes = [index for index, fragment in enumerate(fragments) if fragment is None]
+                if len(indexes) == 0:
+                    continue
+            self._nacked[sequence] = now
+            missing.append((sequence, indexes))
+        return missing
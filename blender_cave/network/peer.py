@@ -0,0 +1,226 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+import errno
+import struct
+import socket
+import collections
+import blender_cave.buffer
+import blender_cave.base
+
+# Errors of a non-blocking socket that is not ready yet (python 3.2 has neither
+# BlockingIOError nor InterruptedError : they all come as socket.error)
+RETRY_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+def receiveHello(peer_socket, received, size):
+    """Receive the rest of the first message of a connection (size bytes, without any size header) inside received
+
+    Never reads past this message : the next ones belong to the Peer. Return False if the connection is closed"""
+    while len(received) < size:
+        try:
+            data = peer_socket.recv(size - len(received))
+        except socket.error as error:
+            return error.errno in RETRY_ERRORS
+        if len(data) == 0:
+            return False
+        received += data
+    return True
+
+class Peer(blender_cave.base.Base):
+    """One end of a connection between the master and a slave
+
+    Outgoing messages are queued and sent without blocking: the connector
+    drains the queue when select reports the socket as writable.
+    Incoming messages are received inside a single growable bytearray and
+    given back as Buffer views on it."""
+
+    SIZE_FORMAT    = '>i'
+    SIZE_LENGTH    = struct.calcsize(SIZE_FORMAT)
+    # Initial size of the reception buffer (it grows with the biggest message)
+    RECEIVE_SIZE   = 64 * 1024
+    # Over this amount of pending bytes, the master stops sending the frames to this peer ...
+    HIGH_WATERMARK = 4 * 1024 * 1024
+    # ... until it goes under this one
+    LOW_WATERMARK  = 1024 * 1024
+    # Maximum number of buffers given to a single sendmsg call
+    MAX_IOV        = 64
+
+    def __init__(self, parent, peer_socket, address):
+        super(Peer, self).__init__(parent)
+        self._socket  = peer_socket
+        self._address = address
+        self._output  = collections.deque()
+        self._pending = 0
+        self._broken  = False
+        self._input   = bytearray(self.RECEIVE_SIZE)
+        # Unprocessed data of self._input is between self._start and self._end
+        self._start   = 0
+        self._end     = 0
+        self._socket.setblocking(False)
+        self._statistics = {'messages'    : 0,
+                            'bytes'       : 0,
+                            'syscalls'    : 0,
+                            'partial'     : 0,
+                            'max_pending' : 0}
+
+    def getSocket(self):
+        return self._socket
+
+    def getAddress(self):
+        return self._address
+
+    def getStatistics(self):
+        return self._statistics
+
+    def getPending(self):
+        return self._pending
+
+    def hasPendingOutput(self):
+        return self._pending > 0
+
+    def isOverloaded(self):
+        return self._pending > self.HIGH_WATERMARK
+
+    def isDrained(self):
+        return self._pending <= self.LOW_WATERMARK
+
+    def isBroken(self):
+        return self._broken
+
+    def send(self, data):
+        """Queue a message (size header followed by data) and try to send it right now
+
+        data must not be modified until it has been sent. Return False if the connection is broken"""
+        if self._broken:
+            return False
+        self._output.append(struct.pack(self.SIZE_FORMAT, len(data)))
+        if len(data) > 0:
+            self._output.append(memoryview(data))
+        self._pending += len(data) + self.SIZE_LENGTH
+        self._statistics['messages'] += 1
+        if self._pending > self._statistics['max_pending']:
+            self._statistics['max_pending'] = self._pending
+        return self.flush()
+
+    def flush(self):
+        """Send as much pending data as the socket accepts. Return False if the connection is broken"""
+        while self._pending > 0:
+            try:
+                if hasattr(self._socket, 'sendmsg'):
+                    buffers = [self._output[index] for index in range(min(len(self._output), self.MAX_IOV))]
+                    sent = self._socket.sendmsg(buffers)
+                else:
+                    sent = self._socket.send(self._output[0])
+            except socket.error as error:
+                if error.errno in RETRY_ERRORS:
+                    self._statistics['partial'] += 1
+                    return True
+                self.getLogger().debug('Cannot send to ' + self._address + ' : ' + str(error))
+                self._broken = True
+                return False
+            self._statistics['syscalls'] += 1
+            self._statistics['bytes']    += sent
+            self._pending                -= sent
+            while sent > 0:
+                head = self._output[0]
+                if sent < len(head):
+                    self._output[0] = memoryview(head)[sent:]
+                    self._statistics['partial'] += 1
+                    return True
+                sent -= len(head)
+                self._output.popleft()
+        return True
+
+    def receive(self):
+        """Receive the available data and get the complete messages
+
+        The messages are Buffer views on the reception buffer: they are only
+        valid until the next call. Return None if the connection is closed"""
+        if self._broken:
+            return None
+        while True:
+            self._reserve()
+            try:
+                size = self._socket.recv_into(memoryview(self._input)[self._end:])
+            except socket.error as error:
+                if error.errno in RETRY_ERRORS:
+                    break
+                self.getLogger().debug('Cannot receive from ' + self._address + ' : ' + str(error))
+                self._broken = True
+                return None
+            if size == 0:
+                self._broken = True
+                return None
+            self._end += size
+            # Otherwise, the socket may still contain data
+            if self._end < len(self._input):
+                break
+
+        messages = []
+        view     = memoryview(self._input)
+        while self._end - self._start >= self.SIZE_LENGTH:
+            size = struct.unpack_from(self.SIZE_FORMAT, self._input, self._start)[0]
+            end  = self._start + self.SIZE_LENGTH + size
+            if end > self._end:
+                break
+            messages.append(blender_cave.buffer.Buffer(view[self._start + self.SIZE_LENGTH:end]))
+            self._start = end
+        return messages
+
+    def _reserve(self):
+        # Make room at the end of the reception buffer for the current message
+        if self._start == self._end:
+            self._start = 0
+            self._end   = 0
+        needed = self.SIZE_LENGTH
+        if self._end - self._start >= self.SIZE_LENGTH:
+            needed += struct.unpack_from(self.SIZE_FORMAT, self._input, self._start)[0]
+        needed = max(needed, self._end - self._start + 1)
+        if len(self._input) - self._start >= needed:
+            if self._end < len(self._input):
+                return
+        if needed <= len(self._input):
+            # Views on the previous messages may still exist: don't resize in place
+            self._input[0:self._end - self._start] = self._input[self._start:self._end]
+        else:
+            size = len(self._input)
+            while size < needed:
+                size *= 2
+            data = bytearray(size)
+            data[0:self._end - self._start] = self._input[self._start:self._end]
+            self._input = data
+        self._end  -= self._start
+        self._start = 0
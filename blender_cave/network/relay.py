@@ -0,0 +1,285 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+"""Relay of the master connection to other slaves
+
+A relay is a slave that forwards the messages of the master to its children
+before applying them, so the master does not send each frame to each slave :
+ - per computer : the first slave of a computer that opens the relay port
+   (the port of the master plus one, on the loopback interface) is the only
+   one of this computer connected to the master, the other screens of the
+   computer are its children,
+ - as a tree : each slave receives the frames from its parent inside a k-ary
+   tree of the screens, rooted at the master.
+
+The children talk to the relay as they would to the master. The relay tells
+the master which screens it relays (its children and their own children),
+routes the answers of the master to them, answers the clock requests of its
+children and acknowledges the barrier once all of them reached it.
+
+Both modes share this code, so inside a tree every interior screen is such a
+relay : a faulty connection of a child (closed before or after saying who it
+is) only drops this child, never the relay and the subtree it serves. The
+children only receive the live stream of the master, never the messages that
+let their relay itself join the simulation."""
+
+import struct
+import socket
+import blender_cave.buffer
+import blender_cave.exceptions
+import blender_cave.base
+from .peer import Peer
+from .peer import receiveHello
+
+class Relay(blender_cave.base.Base):
+
+    def __init__(self, parent, config, select, address):
+        """Listen to the children on address. Raise socket.error if it is already used"""
+        super(Relay, self).__init__(parent)
+        self._select       = select
+        self._children     = {}
+        self._identifying  = {}
+        # For each frame, the children that acknowledged it
+        self._acknowledged = {}
+        self._frame        = None
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self._socket.bind(address)
+            self._socket.listen(config['number_screens'])
+        except socket.error:
+            self._socket.close()
+            raise
+        self._socket.setblocking(False)
+        self._select.setClient(self._socket, self._connectChild)
+
+    def getScreens(self):
+        """Get the IDs of the screens relayed"""
+        screens = []
+        for child in self._children.values():
+            screens.append(child['id'])
+            screens += child['screens']
+        return screens
+
+    def _connectChild(self, server):
+        try:
+            child_socket, address = self._socket.accept()
+        except socket.error:
+            return
+        child_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        child_socket.setblocking(False)
+        self._identifying[child_socket] = (address, bytearray())
+        self._select.setClient(child_socket, self._identifyChild)
+
+    def _identifyChild(self, child_socket):
+        address, hello = self._identifying[child_socket]
+        # The master answers with its protocol version when it activates the child
+        HELLO_FORMAT = self.getParent().HELLO_FORMAT
+        size = struct.calcsize(HELLO_FORMAT)
+        if not receiveHello(child_socket, hello, size):
+            # A screen that crashed or restarted : it will connect again, the other ones go on
+            self.getLogger().warning("Connection of a screen " + str(address) + " to the relay closed before its connection message")
+            del(self._identifying[child_socket])
+            self._select.setClient(child_socket, None)
+            child_socket.close()
+            return
+        if len(hello) < size:
+            # Wait for the rest of the message
+            return
+        del(self._identifying[child_socket])
+        self._select.setClient(child_socket, None)
+        screen_id = struct.unpack_from(HELLO_FORMAT, hello)[0]
+        for index, child in list(self._children.items()):
+            if child['id'] == screen_id:
+                # The previous connection of a restarted screen may not be detected as lost yet
+                self._delChild(index)
+        self.getLogger().info("Relay of screen [" + str(screen_id) + "] : " + str(address))
+        self._children[child_socket] = {'id'      : screen_id,
+                                        'peer'    : Peer(self, child_socket, str(address)),
+                                        # Only receives the messages of the master once the master answered
+                                        'active'  : False,
+                                        # The screens it relays
+                                        'screens' : []}
+        self._select.setClient(child_socket, self._processMessageFromChild)
+        self.getParent()._relayScreen(screen_id, True)
+
+    def _delChild(self, child_socket):
+        child = self._children.pop(child_socket, None)
+        if child is None:
+            return
+        self.getLogger().warning("Lose connection to relayed screen [" + str(child['id']) + "]")
+        self._select.setClient(child_socket, None)
+        self._select.setWriter(child_socket, None)
+        try:
+            child_socket.close()
+        except socket.error:
+            pass
+        for acknowledged in self._acknowledged.values():
+            acknowledged.discard(child_socket)
+        for screen_id in [child['id']] + child['screens']:
+            self.getParent()._relayScreen(screen_id, False)
+        self._checkBarrier()
+
+    def activate(self, screen_id, buffer):
+        """The master answered to the connection of the screen : send it the joining messages, then the next frames
+
+        Also used once the screen joined, to send it a snapshot when it missed frames"""
+        for child in list(self._children.values()):
+            if child['id'] == screen_id:
+                child['active'] = True
+                if not buffer.isEmpty():
+                    self._sendTo(child, bytes(buffer.getData()))
+                return
+            if screen_id in child['screens']:
+                # The screen is relayed by this child
+                answer = blender_cave.buffer.Buffer()
+                answer.command(self.getParent().RELAY)
+                answer.integer(screen_id)
+                answer.subBuffer(buffer)
+                self._sendTo(child, bytes(answer.getData()))
+                return
+
+    def forward(self, buffer):
+        """Forward a message of the master to the children
+
+        Only the live stream : the messages to join the simulation (VERSION, SNAPSHOT, ...) that the master sends
+        to this relay are not for the children, that got their own ones through activate()"""
+        parent = self.getParent()
+        # Master sends each message apart : its first command tells what it is. EVERYBODY_HERE
+        # leads a message only when the simulation starts, otherwise it ends the joining messages
+        command = bytes(buffer.getData()[0:1])
+        if command not in (parent.SYNCHRONIZER, parent.HEARTBEAT, parent.BARRIER, parent.RELEASE, parent.EVERYBODY_HERE, parent.QUIT):
+            return
+        data = None
+        for child in list(self._children.values()):
+            if child['active']:
+                if data is None:
+                    # The message is a view on the reception buffer of the connection to the master
+                    data = bytes(buffer.getData())
+                self._sendTo(child, data)
+
+    def acknowledge(self, frame):
+        """This slave applied the frame : acknowledge it to the master once the children also did"""
+        self._frame = frame
+        self._checkBarrier()
+
+    def _checkBarrier(self):
+        if self._frame is None:
+            return
+        acknowledged = self._acknowledged.get(self._frame, set())
+        for child_socket, child in self._children.items():
+            if child['active'] and (child_socket not in acknowledged):
+                return
+        self.getParent()._acknowledge(self._frame)
+        for frame in list(self._acknowledged.keys()):
+            if frame <= self._frame:
+                del(self._acknowledged[frame])
+        self._frame = None
+
+    def _processMessageFromChild(self, child_socket):
+        parent  = self.getParent()
+        child = self._children[child_socket]
+        buffers = child['peer'].receive()
+        if buffers is None:
+            self._delChild(child_socket)
+            return
+        for buffer in buffers:
+            while not buffer.isEmpty():
+                command = buffer.command()
+                if command == parent.PING:
+                    sent = buffer.double()
+                    # The children share the clock of this computer : give them our estimation of the master clock
+                    if parent.getClock().isSynchronized():
+                        pong = blender_cave.buffer.Buffer()
+                        pong.command(parent.PONG)
+                        pong.double(sent)
+                        pong.double(parent.getMasterTime())
+                        pong.double(parent.getMasterTime())
+                        self._sendTo(child, bytes(pong.getData()))
+                elif command == parent.ACKNOWLEDGE:
+                    frame = buffer.integer()
+                    self._acknowledged.setdefault(frame, set()).add(child_socket)
+                    self._checkBarrier()
+                elif command == parent.RELAY:
+                    # The child is itself a relay
+                    screen_id = buffer.integer()
+                    connected = buffer.boolean()
+                    if connected:
+                        child['screens'].append(screen_id)
+                    elif screen_id in child['screens']:
+                        child['screens'].remove(screen_id)
+                    parent._relayScreen(screen_id, connected)
+                else:
+                    raise blender_cave.exceptions.Controller("Unattended command (" + str(command) + ") from relayed screen [" + str(child['id']) + "]")
+
+    def _sendTo(self, child, data):
+        peer = child['peer']
+        if not peer.send(data):
+            self._delChild(peer.getSocket())
+            return
+        self._updateWriter(peer)
+
+    def _flushChild(self, child_socket):
+        if child_socket not in self._children:
+            self._select.setWriter(child_socket, None)
+            return
+        peer = self._children[child_socket]['peer']
+        if not peer.flush():
+            self._delChild(child_socket)
+            return
+        self._updateWriter(peer)
+
+    def _updateWriter(self, peer):
+        if peer.hasPendingOutput():
+            self._select.setWriter(peer.getSocket(), self._flushChild)
+        else:
+            self._select.setWriter(peer.getSocket(), None)
+
+    def close(self):
+        for child_socket, child in list(self._children.items()):
+            # Last chance for the message of the master (QUIT) to reach the child
+            child['peer'].flush()
+            self._select.setClient(child_socket, None)
+            self._select.setWriter(child_socket, None)
+            child_socket.close()
+        self._children = {}
+        for child_socket in list(self._identifying.keys()):
+            self._select.setClient(child_socket, None)
+            child_socket.close()
+        self._identifying = {}
+        self._select.setClient(self._socket, None)
+        self._socket.close()
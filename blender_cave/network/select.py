@@ -33,34 +33,98 @@
 ## knowledge of the CeCILL license and that you accept its terms.
 ## 
 
+import time
 import select
 import blender_cave.base
 
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
 class Select(blender_cave.base.Base):
-    
+    """Dispatch the readiness of the sockets to their methods
+
+    Uses the selectors module (epoll, kqueue ...) when available, so the
+    registrations are kept by the kernel instead of being rebuilt at each
+    call. Otherwise, falls back to select.select."""
+
+    # Without waiting, stop dispatching after this time (seconds) : the
+    # remaining sockets are still ready at the next call
+    TIME_SLICE = 0.005
+
     def __init__(self, parent):
         super(Select, self).__init__(parent)
-        self._select  = []
         self._clients = {}
+        self._writers = {}
+        if selectors is not None:
+            self._selector = selectors.DefaultSelector()
+        else:
+            self._selector = None
 
     def setClient(self, client, method = None):
         if method is None:
-            if client in self._select:
-                self._select.remove(client)
-            if client not in self._clients:
+            if client in self._clients:
                 del(self._clients[client])
         else:
-            if client not in self._select:
-                self._select.append(client)
             self._clients[client] = method
+        self._update(client)
 
-    def run(self, wait):
-        if len(self._select) == 0:
+    def setWriter(self, client, method = None):
+        if method is None:
+            if client in self._writers:
+                del(self._writers[client])
+        else:
+            self._writers[client] = method
+        self._update(client)
+
+    def _update(self, client):
+        if self._selector is None:
             return
+        events = 0
+        if client in self._clients:
+            events |= selectors.EVENT_READ
+        if client in self._writers:
+            events |= selectors.EVENT_WRITE
+        try:
+            key = self._selector.get_key(client)
+        except (KeyError, ValueError):
+            key = None
+        try:
+            if events == 0:
+                if key is not None:
+                    self._selector.unregister(client)
+            elif key is None:
+                self._selector.register(client, events)
+            elif key.events != events:
+                self._selector.modify(client, events)
+        except (KeyError, ValueError, OSError):
+            # The socket has already been closed
+            pass
 
-        if wait:
-            inputready,outputready,exceptready = select.select(self._select, [], [])
+    def run(self, wait, timeout = None):
+        if (len(self._clients) == 0) and (len(self._writers) == 0):
+            return
+
+        if not wait:
+            timeout = 0
+        if self._selector is None:
+            inputready, outputready, exceptready = select.select(list(self._clients.keys()), list(self._writers.keys()), [], timeout)
         else:
-            inputready,outputready,exceptready = select.select(self._select, [], [], 0)
+            inputready  = []
+            outputready = []
+            for key, events in self._selector.select(timeout):
+                if events & selectors.EVENT_WRITE:
+                    outputready.append(key.fileobj)
+                if events & selectors.EVENT_READ:
+                    inputready.append(key.fileobj)
+
+        start = time.time()
+        for peer in outputready:
+            if peer in self._writers:
+                self._writers[peer](peer)
         for peer in inputready:
-            self._clients[peer](peer)
+            if (not wait) and (time.time() - start > self.TIME_SLICE):
+                break
+            if peer in self._clients:
+                self._clients[peer](peer)
@@ -0,0 +1,218 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+"""Ring buffer of the synchronizer frames inside a shared memory
+
+The master publishes each frame once inside a memory mapped file. The slaves
+that run on the same computer read it from there, instead of receiving their
+own copy through a TCP connection.
+
+Layout of the file : header, index, then the ring of records. Each record is
+its frame sequence number, its length and the frame, aligned on 8 bytes. The
+index gives the position of the last frames, so a reader can start at any
+recent frame. Positions are absolute (they never wrap). Before writing a
+record, the writer reserves the space up to its end : a reader whose position
+is more than the ring capacity behind the reservation has been overrun."""
+
+import os
+import mmap
+import random
+import struct
+import tempfile
+import blender_cave.buffer
+import blender_cave.exceptions
+import blender_cave.base
+
+class Base(blender_cave.base.Base):
+
+    MAGIC         = b'BCSM'
+    # magic, token of the master, capacity, sequence of the next frame, head position, reserved position
+    HEADER_FORMAT = '>4sIQQQQ'
+    HEADER_SIZE   = struct.calcsize(HEADER_FORMAT)
+    STATE_OFFSET  = 16
+    STATE_FORMAT  = '>QQQ'
+    INDEX_LENGTH  = 1024
+    INDEX_FORMAT  = '>Q'
+    INDEX_SIZE    = INDEX_LENGTH * struct.calcsize(INDEX_FORMAT)
+    RECORD_FORMAT = '>QI'
+    RECORD_SIZE   = struct.calcsize(RECORD_FORMAT)
+    # Length of the record that tells to go back to the start of the ring
+    WRAP          = 0xFFFFFFFF
+    ALIGNMENT     = 8
+
+    def __init__(self, parent, config):
+        super(Base, self).__init__(parent)
+        self._path   = self.getPath(config['port'])
+        self._memory = None
+
+    @staticmethod
+    def getPath(port):
+        if os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+        else:
+            directory = tempfile.gettempdir()
+        return os.path.join(directory, 'blender_cave-' + str(port) + '.shm')
+
+    def _getState(self):
+        # The writer may update the state meanwhile : read it until it is stable
+        state = struct.unpack_from(self.STATE_FORMAT, self._memory, self.STATE_OFFSET)
+        while True:
+            again = struct.unpack_from(self.STATE_FORMAT, self._memory, self.STATE_OFFSET)
+            if again == state:
+                return state
+            state = again
+
+    def _getOffset(self, position):
+        return self.HEADER_SIZE + self.INDEX_SIZE + (position % self._capacity)
+
+    def getToken(self):
+        return self._token
+
+    def close(self):
+        if self._memory is not None:
+            self._memory.close()
+            self._memory = None
+
+class Sender(Base):
+
+    def __init__(self, parent, config):
+        super(Sender, self).__init__(parent, config)
+        self._capacity = config['shared_memory']
+        self._token    = random.randint(1, 0x7FFFFFFF)
+        self._sequence = 0
+        self._head     = 0
+        size = self.HEADER_SIZE + self.INDEX_SIZE + self._capacity
+        with open(self._path, 'w+b') as memory_file:
+            memory_file.truncate(size)
+            self._memory = mmap.mmap(memory_file.fileno(), size)
+        struct.pack_into(self.HEADER_FORMAT, self._memory, 0, self.MAGIC, self._token, self._capacity, 0, 0, 0)
+
+    def getSequence(self):
+        """Get the sequence number of the next frame"""
+        return self._sequence
+
+    def send(self, buffer):
+        """Publish the frame. Return False if it is too big for the ring"""
+        data   = buffer.getData()
+        length = self.RECORD_SIZE + len(data)
+        length = (length + self.ALIGNMENT - 1) // self.ALIGNMENT * self.ALIGNMENT
+        if length > self._capacity // 2:
+            return False
+        remaining = self._capacity - (self._head % self._capacity)
+        if length > remaining:
+            reserved = self._head + remaining + length
+        else:
+            reserved = self._head + length
+        struct.pack_into(self.STATE_FORMAT, self._memory, self.STATE_OFFSET, self._sequence, self._head, reserved)
+        if length > remaining:
+            if remaining >= self.RECORD_SIZE:
+                struct.pack_into(self.RECORD_FORMAT, self._memory, self._getOffset(self._head), self._sequence, self.WRAP)
+            self._head += remaining
+        offset = self._getOffset(self._head)
+        struct.pack_into(self.RECORD_FORMAT, self._memory, offset, self._sequence, len(data))
+        self._memory[offset + self.RECORD_SIZE:offset + self.RECORD_SIZE + len(data)] = data
+        struct.pack_into(self.INDEX_FORMAT, self._memory, self.HEADER_SIZE + (self._sequence % self.INDEX_LENGTH) * struct.calcsize(self.INDEX_FORMAT), self._head)
+        self._head     += length
+        self._sequence += 1
+        # Updated after the record : the readers never see an incomplete one
+        struct.pack_into(self.STATE_FORMAT, self._memory, self.STATE_OFFSET, self._sequence, self._head, self._head)
+        return True
+
+    def close(self):
+        super(Sender, self).close()
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+class Receiver(Base):
+
+    def __init__(self, parent, config):
+        """Open the shared memory of a master running on this computer. Raise IOError if there is none"""
+        super(Receiver, self).__init__(parent, config)
+        with open(self._path, 'r+b') as memory_file:
+            self._memory = mmap.mmap(memory_file.fileno(), 0)
+        magic, self._token, self._capacity, sequence, head, reserved = struct.unpack_from(self.HEADER_FORMAT, self._memory)
+        if magic != self.MAGIC:
+            self.close()
+            raise IOError('Invalid shared memory : ' + self._path)
+        self._next     = None
+        self._position = None
+
+    def isAttached(self):
+        return self._next is not None
+
+    def attach(self, sequence):
+        """Read the frames from sequence"""
+        published, head, reserved = self._getState()
+        self._next = sequence
+        if sequence >= published:
+            self._position = head
+        else:
+            self._position = struct.unpack_from(self.INDEX_FORMAT, self._memory, self.HEADER_SIZE + (sequence % self.INDEX_LENGTH) * struct.calcsize(self.INDEX_FORMAT))[0]
+
+    def detach(self):
+        self._next     = None
+        self._position = None
+
+    def getFrames(self):
+        """Get the frames published since the last call, and whether the writer overran this reader"""
+        frames = []
+        published, head, reserved = self._getState()
+        while self._next < published:
+            if reserved - self._position > self._capacity:
+                return frames, True
+            offset    = self._getOffset(self._position)
+            remaining = self._capacity - (self._position % self._capacity)
+            if remaining < self.RECORD_SIZE:
+                self._position += remaining
+                continue
+            sequence, length = struct.unpack_from(self.RECORD_FORMAT, self._memory, offset)
+            if length == self.WRAP:
+                self._position += remaining
+                continue
+            if sequence != self._next:
+                return frames, True
+            # Copied : the writer never waits for the readers, so a view would be overwritten once the ring wraps
+            # around, while the frame may still be decoded. The copy is only valid if the writer did not reach it meanwhile
+            data = self._memory[offset + self.RECORD_SIZE:offset + self.RECORD_SIZE + length]
+            published, head, reserved = self._getState()
+            if reserved - self._position > self._capacity:
+                return frames, True
+            frames.append(blender_cave.buffer.Buffer(data))
+            self._position += (self.RECORD_SIZE + length + self.ALIGNMENT - 1) // self.ALIGNMENT * self.ALIGNMENT
+            self._next     += 1
+        return frames, False
@@ -34,6 +34,7 @@
 ## 
 
 import socket
+import collections
 import blender_cave.buffer
 import blender_cave.exceptions
 import blender_cave.base
@@ -68,7 +69,8 @@ class Master(Base):
         newObjects = blender_cave.buffer.Buffer()
         while len(self._synchronizedObjectsToAdd) > 0:
             object = self._synchronizedObjectsToAdd.pop()
-            objects_id = id(object)
+            # Dense IDs : the objects are never removed
+            objects_id = len(self._synchronizedObjects)
             self._synchronizedObjects[objects_id] = object
             newObjects.itemID(objects_id)
             newObjects.string(object._synchronize_object_name)
@@ -86,29 +88,117 @@ class Master(Base):
 
         return buffer
 
+    def getDatagramBuffer(self, frame, baseline):
+        """Get the states of the objects sent on the datagram channel (ie. : the ones that the next frame replaces)"""
+        buffer = blender_cave.buffer.Buffer()
+        for objects_id, object in self._synchronizedObjects.items():
+            if not hasattr(object, 'getDatagramBuffer'):
+                continue
+            object_data_buffer = object.getDatagramBuffer(frame, baseline)
+            if object_data_buffer is not None:
+                buffer.command(self.OBJECT)
+                buffer.itemID(objects_id)
+                buffer.subBuffer(object_data_buffer)
+        return buffer
+
+    def getSnapshotBuffer(self):
+        """Get the full state of the objects already synchronized, for a slave that joins during the simulation"""
+        buffer = blender_cave.buffer.Buffer()
+
+        newObjects = blender_cave.buffer.Buffer()
+        for objects_id, object in self._synchronizedObjects.items():
+            newObjects.itemID(objects_id)
+            newObjects.string(object._synchronize_object_name)
+        if not newObjects.isEmpty():
+            buffer.command(self.NEW_OBJECT)
+            buffer.subBuffer(newObjects)
+
+        # Objects without snapshot only send their next changes
+        for objects_id, object in self._synchronizedObjects.items():
+            if not hasattr(object, 'getSnapshotBuffer'):
+                continue
+            object_data_buffer = object.getSnapshotBuffer()
+            if (object_data_buffer is not None) and (not object_data_buffer.isEmpty()):
+                buffer.command(self.OBJECT)
+                buffer.itemID(objects_id)
+                buffer.subBuffer(object_data_buffer)
+
+        return buffer
+
 class Slave(Base):
 
     def __init__(self, parent, config):
         super(Slave, self).__init__(parent)
+        # Objects waiting for their ID, by name, in their registration order
+        self._synchronizedObjectsByName = {}
+
+    def run(self):
+        # Objects that update the scene at each rendering (ie. : smoothing)
+        for object in list(self._synchronizedObjects.values()):
+            if hasattr(object, 'preRender'):
+                object.preRender()
 
+    def addObjectToSynchronize(self, object, name):
+        object._synchronize_object_name = name
+        self._synchronizedObjectsByName.setdefault(name, collections.deque()).append(object)
 
     def process(self, buffer):
+        self.processFrames([buffer])
+
+    def processHeartbeat(self):
+        """The master sent a frame without any change"""
+        for object in list(self._synchronizedObjects.values()):
+            if hasattr(object, 'processHeartbeat'):
+                object.processHeartbeat()
+
+    def processDatagram(self, frame, buffer):
+        """Apply a datagram frame. Return False if an object could not use it"""
+        accepted = True
         while not buffer.isEmpty():
             command = buffer.command()
-
-            if command == self.NEW_OBJECT:
-                new_objects_buffer = buffer.subBuffer()
-                while not new_objects_buffer.isEmpty():
-                    objects_id   = new_objects_buffer.itemID()
-                    objects_name = new_objects_buffer.string()
-                    for i in range(len(self._synchronizedObjectsToAdd)):
-                        if self._synchronizedObjectsToAdd[i]._synchronize_object_name == objects_name:
-                            object = self._synchronizedObjectsToAdd.pop(i)
-                            self._synchronizedObjects[objects_id] = object
-                            break
-
-            elif command == self.OBJECT:
+            if command == self.OBJECT:
                 objects_id   = buffer.itemID()
                 objectBuffer = buffer.subBuffer()
-                if objects_id in self._synchronizedObjects:
-                    self._synchronizedObjects[objects_id].processSynchronizerBuffer(objectBuffer)
+                object       = self._synchronizedObjects.get(objects_id)
+                if (object is None) or (not hasattr(object, 'processDatagramBuffer')):
+                    accepted = False
+                elif not object.processDatagramBuffer(frame, objectBuffer):
+                    accepted = False
+        return accepted
+
+    def processFrames(self, buffers):
+        """Apply consecutive frames at once
+
+        Each object gets all its data, in order, so it can merge them (ie. : only apply the last transformations)"""
+        objects_buffers = collections.OrderedDict()
+        for buffer in buffers:
+            while not buffer.isEmpty():
+                command = buffer.command()
+
+                if command == self.NEW_OBJECT:
+                    new_objects_buffer = buffer.subBuffer()
+                    while not new_objects_buffer.isEmpty():
+                        objects_id   = new_objects_buffer.itemID()
+                        objects_name = new_objects_buffer.string()
+                        try:
+                            waiting = self._synchronizedObjectsByName[objects_name]
+                        except KeyError:
+                            continue
+                        self._synchronizedObjects[objects_id] = waiting.popleft()
+                        if len(waiting) == 0:
+                            del(self._synchronizedObjectsByName[objects_name])
+
+                elif command == self.OBJECT:
+                    objects_id   = buffer.itemID()
+                    objectBuffer = buffer.subBuffer()
+                    objects_buffers.setdefault(objects_id, []).append(objectBuffer)
+
+        for objects_id, objectBuffers in objects_buffers.items():
+            if objects_id not in self._synchronizedObjects:
+                continue
+            object = self._synchronizedObjects[objects_id]
+            if hasattr(object, 'processSynchronizerBuffers'):
+                object.processSynchronizerBuffers(objectBuffers)
+            else:
+                for objectBuffer in objectBuffers:
+                    object.processSynchronizerBuffer(objectBuffer)
@@ -48,9 +48,8 @@ class ReloadBackupper(blender_cave.base.Base):
             self._backup_filename = os.path.join(tempfile.gettempdir(), 'blender_cave.!PID!.dat')
         self._backup_filename = self._backup_filename.replace('!PID!', str(os.getpid()))
         try:
-            buffer = blender_cave.buffer.Buffer()
             file = open(self._backup_filename, "rb")
-            buffer._buffer = file.read()
+            buffer = blender_cave.buffer.Buffer(file.read())
             file.close()
             self._buffers = {}
             while not buffer.isEmpty():
@@ -76,7 +75,7 @@ class ReloadBackupper(blender_cave.base.Base):
             buffer.string(buffer_name)
             buffer.subBuffer(obj_buffer)
             file = open(self._backup_filename, "ab")
-            file.write(buffer._buffer)
+            file.write(buffer.getData())
             file.close()
 
     def getBuffer(self, buffer_name):
@@ -44,10 +44,13 @@ class Synchronizer(blender_cave.base.Base):
     END_UPDATE_ITEM = b'e'
     DELETE_ITEM     = b'd'
     SET_ATTRIBUTE   = b'a'
+    TRANSFORMS      = b't'
 
-    def __init__(self, parent):
+    def __init__(self, parent, config):
         super(Synchronizer, self).__init__(parent)
 
+        self._config = config
+
         self._item_types = {}
         item_types = { 'module'             : 'item_root',
                        'KX_Scene'           : 'item_scene',
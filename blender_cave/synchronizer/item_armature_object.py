@@ -34,27 +34,102 @@
 ## 
 
 from . import item_object
+from . import pose
 import blender_cave.exceptions
 
 class ArmatureObject:
 
     OBJECT =   b'o'
     FRAME  =   b'f'
+    POSE   =   b'p'
+    ACTION =   b'a'
 
     def __init__(self, parent, item):
         super(ArmatureObject, self).__init__(parent, item)
-        self._channels = []
-        return
-        for channel in self._item.channels:
-            self._channels.append(self.getParent().getItem(channel))
-
-    def _getSubItems(self):
-        return list(self._item.channels)
 
 class Master(ArmatureObject, item_object.Master):
+
+    # Seconds between two corrections of the frames of the actions played by the slaves
+    DRIFT_PERIOD = 1.0
+
     def __init__(self, parent, item):
         super(Master, self).__init__(parent, item)
-        self._curentActionFrame = self._item.getActionFrame()
+        # The channels are synchronized all at once, not as items
+        self._pose = pose.Master(self, self._item.channels)
+        # Actions also played by the slaves : parameters of playAction, layers to send again,
+        # last (master time, frame, frame rate) and time of the last correction by layer
+        self._actions     = {}
+        self._changed     = set()
+        self._samples     = {}
+        self._corrected   = {}
+        self._corrections = None
+        self._procedural  = []
+
+    def playAction(self, name, start_frame, end_frame, layer = 0, priority = 0, blendin = 0, play_mode = 0, layer_weight = 0.0, ipo_flags = 0, speed = 1.0):
+        """Play the action on the armature and on the slaves, that evaluate it locally
+
+        To use instead of the playAction method of the armature (same parameters) : only its frame is sent from time to time"""
+        self._item.playAction(name, start_frame, end_frame, layer, priority, blendin, play_mode, layer_weight, ipo_flags, speed)
+        self._actions[layer] = (name, start_frame, end_frame, priority, blendin, play_mode, layer_weight, ipo_flags, speed)
+        self._samples.pop(layer, None)
+        self._corrected.pop(layer, None)
+        self._changed.add(layer)
+        self._updateStreamed()
+
+    def stopAction(self, layer = 0):
+        self._item.stopAction(layer)
+        self._stopLayer(layer)
+
+    def setProceduralChannels(self, names):
+        """Channels driven by the code : their pose is still sent while the slaves play the actions"""
+        self._procedural = [index for index, channel in enumerate(self._item.channels) if channel.name in names]
+        self._updateStreamed()
+
+    def _stopLayer(self, layer):
+        if self._actions.pop(layer, None) is None:
+            return
+        self._samples.pop(layer, None)
+        self._corrected.pop(layer, None)
+        self._changed.add(layer)
+        self._updateStreamed()
+
+    def _updateStreamed(self):
+        if len(self._actions) == 0:
+            self._pose.setStreamed(None)
+        else:
+            self._pose.setStreamed(self._procedural)
+
+    def _sampleActions(self):
+        """Measure the frame rate of the actions and forget the finished ones. Return the layers to correct"""
+        if len(self._actions) == 0:
+            return []
+        now         = self.getBlenderCave().getMasterTime()
+        corrections = []
+        for layer in list(self._actions.keys()):
+            if not self._item.isPlayingAction(layer):
+                self._stopLayer(layer)
+                continue
+            frame    = self._item.getActionFrame(layer)
+            previous = self._samples.get(layer)
+            rate     = 0.0
+            if previous is not None:
+                rate = previous[2]
+                start_frame, end_frame = self._actions[layer][1:3]
+                # Not when the action loops back
+                if (now > previous[0]) and (abs(frame - previous[1]) <= abs(end_frame - start_frame) / 2.0):
+                    rate = (frame - previous[1]) / (now - previous[0])
+            self._samples[layer] = (now, frame, rate)
+            if (layer in self._changed) or (now - self._corrected.get(layer, now - self.DRIFT_PERIOD) >= self.DRIFT_PERIOD):
+                corrections.append(layer)
+        return corrections
+
+    def isPolled(self):
+        return True
+
+    def hasChanged(self):
+        self._corrections = self._sampleActions()
+        pose_changed      = self._pose.hasChanged()
+        return pose_changed or (len(self._changed) > 0) or (len(self._corrections) > 0)
 
     def getSynchronizerBuffer(self):
         buffer = blender_cave.buffer.Buffer()
@@ -64,15 +139,71 @@ class Master(ArmatureObject, item_object.Master):
             buffer.command(self.OBJECT)
             buffer.subBuffer(object_buffer)
 
-        if (self._curentActionFrame != self._item.getActionFrame()) and False:
-            self._curentActionFrame = self._item.getActionFrame()
-            buffer.command(self.FRAME)
-            buffer.float(self._curentActionFrame)
+        if self._corrections is None:
+            self._corrections = self._sampleActions()
+        for layer in sorted(self._changed):
+            self._addAction(buffer, layer)
+        self._changed.clear()
+        for layer in self._corrections:
+            self._addFrame(buffer, layer)
+            self._corrected[layer] = self._samples[layer][0]
+        self._corrections = None
+
+        pose_buffer = self._pose.getBuffer()
+        if len(pose_buffer) > 0:
+            buffer.command(self.POSE)
+            buffer.subBuffer(pose_buffer)
+        return buffer
+
+    def getStateBuffer(self):
+        buffer = blender_cave.buffer.Buffer()
+        for layer in sorted(self._actions.keys()):
+            self._addAction(buffer, layer)
+            if layer in self._samples:
+                self._addFrame(buffer, layer)
+        pose_buffer = self._pose.getStateBuffer()
+        if len(pose_buffer) > 0:
+            buffer.command(self.POSE)
+            buffer.subBuffer(pose_buffer)
         return buffer
 
+    def _addAction(self, buffer, layer):
+        buffer.command(self.ACTION)
+        buffer.unsigned_char(layer)
+        action = self._actions.get(layer)
+        if action is None:
+            # Stopped
+            buffer.string('')
+            return
+        name, start_frame, end_frame, priority, blendin, play_mode, layer_weight, ipo_flags, speed = action
+        buffer.string(name)
+        buffer.float(start_frame)
+        buffer.float(end_frame)
+        buffer.integer(priority)
+        buffer.float(blendin)
+        buffer.integer(play_mode)
+        buffer.float(layer_weight)
+        buffer.integer(ipo_flags)
+        buffer.float(speed)
+
+    def _addFrame(self, buffer, layer):
+        sample_time, frame, rate = self._samples[layer]
+        buffer.command(self.FRAME)
+        buffer.unsigned_char(layer)
+        buffer.double(sample_time)
+        buffer.float(frame)
+        buffer.float(rate)
+
 class Slave(ArmatureObject, item_object.Slave):
+
+    # Gap (in frames) between the frame of an action on the master and on this slave above which it is corrected
+    DRIFT_TOLERANCE = 0.5
+
     def __init__(self, parent, item):
         super(Slave, self).__init__(parent, item)
+        self._pose    = pose.Slave(self, self._item)
+        # (start frame, end frame) of the actions played, by layer
+        self._actions = {}
 
     def processSynchronizerBuffer(self, buffer):
 
@@ -83,7 +214,41 @@ class Slave(ArmatureObject, item_object.Slave):
                 object_buffer = buffer.subBuffer()
                 super(Slave, self).processSynchronizerBuffer(object_buffer)
 
+            if command == self.ACTION:
+                layer = buffer.unsigned_char()
+                name  = buffer.string()
+                if len(name) == 0:
+                    self._actions.pop(layer, None)
+                    self._item.stopAction(layer)
+                    continue
+                start_frame  = buffer.float()
+                end_frame    = buffer.float()
+                priority     = buffer.integer()
+                blendin      = buffer.float()
+                play_mode    = buffer.integer()
+                layer_weight = buffer.float()
+                ipo_flags    = buffer.integer()
+                speed        = buffer.float()
+                self._item.playAction(name, start_frame, end_frame, layer, priority, blendin, play_mode, layer_weight, ipo_flags, speed)
+                self._actions[layer] = (start_frame, end_frame)
+
             if command == self.FRAME:
-                actionFrame = buffer.float()
-                self._item.setActionFrame(actionFrame)
-                self._item.update()
+                layer       = buffer.unsigned_char()
+                sample_time = buffer.double()
+                frame       = buffer.float()
+                rate        = buffer.float()
+                # Where the master is now
+                self._correctFrame(layer, frame + rate * (self.getBlenderCave().getMasterTime() - sample_time))
+
+            if command == self.POSE:
+                self._pose.process(buffer.subBuffer())
+
+    def _correctFrame(self, layer, frame):
+        if layer not in self._actions:
+            return
+        start_frame, end_frame = self._actions[layer]
+        if not (min(start_frame, end_frame) <= frame <= max(start_frame, end_frame)):
+            # Looped since : the next correction will tell
+            return
+        if abs(self._item.getActionFrame(layer) - frame) > self.DRIFT_TOLERANCE:
+            self._item.setActionFrame(frame, layer)
@@ -41,8 +41,9 @@ import bge
 class Base(blender_cave.base.Base):
     def __init__(self, parent, item):
         super(Base, self).__init__(parent)
-        self._item = item
-        self._name = str(self._item)
+        self._item    = item
+        self._name    = str(self._item)
+        self._item_id = None
 
     def __del__(self):
         try:
@@ -56,7 +57,10 @@ class Base(blender_cave.base.Base):
         return self._item
 
     def getItemID(self):
-        return id(self._item)
+        return self._item_id
+
+    def setItemID(self, item_id):
+        self._item_id = item_id
 
     def __str__(self):
         return self._name
@@ -70,6 +74,9 @@ class Base(blender_cave.base.Base):
     def isSynchronizable(self):
         return True
 
+    def hasTransforms(self):
+        return False
+
     def _getSubItems(self):
         return []
 
@@ -88,31 +95,79 @@ class Master(Base):
         item_id = self.getItemID()
 
         if not self._created:
-            buffer.command(self.getParent().CREATE_ITEM)
-            buffer.itemID(parent_id)
-            buffer.itemID(item_id)
-            item_name = self.getItemName()
-            buffer.string(item_name)
-            try:
-                if self._item.parent is not None:
-                    parent_name = str(self._item.parent)
-                else:
-                    parent_name = item_name
-            except AttributeError:
-                parent_name = item_name
-            buffer.string(parent_name)
+            self._addCreation(buffer, parent_id)
             self._created = True
             if not self.getParent()._firstCreation:
                 self.activate(True, True)
 
+        if self._subItemsChanged():
+            for item in self._getSubItems():
+                item = self.getParent().getItem(item)
+                buffer += item.getCreationBuffer(item_id)
+        return buffer
+
+    def _addCreation(self, buffer, parent_id):
+        buffer.command(self.getParent().CREATE_ITEM)
+        buffer.itemID(parent_id)
+        buffer.itemID(self.getItemID())
+        item_name = self.getItemName()
+        buffer.string(item_name)
+        try:
+            if self._item.parent is not None:
+                parent_name = str(self._item.parent)
+            else:
+                parent_name = item_name
+        except AttributeError:
+            parent_name = item_name
+        buffer.string(parent_name)
+
+    def getSnapshotBuffer(self, parent_id):
+        """Get the creation of this item and of its sub-items that are already created on the slaves"""
+        buffer = blender_cave.buffer.Buffer()
+        if self._created:
+            self._addCreation(buffer, parent_id)
+            buffer += self._getSubItemsSnapshot()
+        return buffer
+
+    def _getSubItemsSnapshot(self):
+        buffer = blender_cave.buffer.Buffer()
         for item in self._getSubItems():
-            item = self.getParent().getItem(item)
-            buffer += item.getCreationBuffer(item_id)
+            item = self.getParent().findItem(item)
+            if item is not None:
+                buffer += item.getSnapshotBuffer(self.getItemID())
         return buffer
 
     def getSynchronizerBuffer(self):
         return blender_cave.buffer.Buffer()
 
+    def getStateBuffer(self):
+        """Get the full state of the item, as last sent to the slaves
+
+        Items whose getSynchronizerBuffer only sends the changes must override it"""
+        return self.getSynchronizerBuffer()
+
+    def isAlive(self):
+        try:
+            str(self._item)
+        except SystemError:
+            return False
+        return True
+
+    def hasChanged(self):
+        """Cheap check of the item state, without building any buffer
+
+        Items that cannot detect their changes are always synchronized"""
+        return True
+
+    def isPolled(self):
+        """Whether hasChanged must be checked at each frame
+
+        Items that never change by themselves are only synchronized through markDirty"""
+        return True
+
+    def _subItemsChanged(self):
+        return True
+
     def activate(self, enable, recursive = False):
         self.getParent()._activateItem(self, enable)
         if recursive:
@@ -124,11 +179,35 @@ class Master(Base):
 class Slave(Base):
     def __init__(self, parent, item):
         super(Slave, self).__init__(parent, item)
+        self._index      = None
+        self._indexState = None
 
     def getItemByName(self, name, parent_name):
-        for subItem in self._getSubItems():
-            if str(subItem) == name:
-                return subItem
+        item = self._getIndex().get(name)
+        if (item is not None) and getattr(item, 'invalid', False):
+            # The object has been freed since the index was built
+            self._index = None
+            item = self._getIndex().get(name)
+        return item
+
+    def _getIndex(self):
+        # Name to sub-item index, rebuilt when the sub-items list changes. As
+        # before, the first sub-item wins when several ones share a name
+        state = self._getSubItemsState()
+        if (self._index is None) or (state is None) or (state != self._indexState):
+            self._index = {}
+            for subItem in self._getSubItems():
+                self._index.setdefault(str(subItem), subItem)
+            self._indexState = state
+        return self._index
+
+    def _addToIndex(self, item):
+        if self._index is not None:
+            self._index.setdefault(str(item), item)
+            self._indexState = self._getSubItemsState()
+
+    def _getSubItemsState(self):
+        """Cheap state of the sub-items list, to know when the index must be rebuilt (None to always rebuild it)"""
         return None
 
     def processSynchronizerBuffer(self, buffer):
@@ -33,17 +33,12 @@
 ## knowledge of the CeCILL license and that you accept its terms.
 ## 
 
-import copy
 import mathutils
 from . import item_base
 import blender_cave.exceptions
 
 class Object:
 
-    POSITION    =   b'p'
-    ORIENTATION =   b'o'
-    SCALE       =   b's'
-
     def __init__(self, parent, item):
         super(Object, self).__init__(parent, item)
         self.default()
@@ -51,47 +46,52 @@ class Object:
     def default(self):
         pass
 
+    def hasTransforms(self):
+        # Position, orientation and scale are synchronized by the transforms batch
+        return True
+
 class Master(Object, item_base.Master):
     def __init__(self, parent, item):
         super(Master, self).__init__(parent, item)
-        self._previousPosition    = mathutils.Vector()
-        self._previousOrientation = mathutils.Matrix()
-        self._previousScale       = mathutils.Vector()
-
-    def getSynchronizerBuffer(self):
-        buffer = blender_cave.buffer.Buffer()
 
-        if self._previousPosition != self._item.worldPosition:
-            self._previousPosition = copy.copy(self._item.worldPosition)
-            buffer.command(self.POSITION)
-            buffer.vector_3(self._previousPosition)
-            
-        if self._previousOrientation != self._item.worldOrientation:
-            self._previousOrientation = copy.copy(self._item.worldOrientation)
-            buffer.command(self.ORIENTATION)
-            buffer.matrix_3x3(self._previousOrientation)
-            
-        if self._previousScale != self._item.worldScale:
-            self._previousScale = copy.copy(self._item.worldScale)
-            buffer.command(self.SCALE)
-            buffer.vector_3(self._previousScale)
+    def hasChanged(self):
+        return False
 
-        return buffer
+    def isPolled(self):
+        # The transforms batch detects the moves of all the objects at once
+        return False
 
 class Slave(Object, item_base.Slave):
     def __init__(self, parent, item):
         super(Slave, self).__init__(parent, item)
 
-    def processSynchronizerBuffer(self, buffer):
+    def getTransforms(self, local = False):
+        if local:
+            return (self._item.localPosition.copy(), self._item.localOrientation.copy(), self._item.localScale.copy())
+        return (self._item.worldPosition.copy(), self._item.worldOrientation.copy(), self._item.worldScale.copy())
 
-        while len(buffer) > 0:
-            command = buffer.command()
+    def setTransforms(self, position, orientation, scale, parent = None):
+        """Set the transformations in world space, or in the space of the parent item"""
+        if parent is not None:
+            self._setLocalTransforms(position, orientation, scale, parent.getItem())
+            return
+        if self._item.parent is not None:
+            # Unparented on the master : don't follow the previous parent anymore
+            self._item.removeParent()
+        if position is not None:
+            self._item.worldPosition = position
+        if orientation is not None:
+            self._item.worldOrientation = orientation
+        if scale is not None:
+            self._item.worldScale = scale
 
-            if command == self.POSITION:
-                self._item.worldPosition = buffer.vector_3()
-            
-            if command == self.ORIENTATION:
-                self._item.worldOrientation = buffer.matrix_3x3()
-            
-            if command == self.SCALE:
-                self._item.worldScale = buffer.vector_3()
+    def _setLocalTransforms(self, position, orientation, scale, parent):
+        if self._item.parent is not parent:
+            # Neither compound nor ghost : the slaves only render the scene
+            self._item.setParent(parent, False, False)
+        if position is not None:
+            self._item.localPosition = position
+        if orientation is not None:
+            self._item.localOrientation = orientation
+        if scale is not None:
+            self._item.localScale = scale
@@ -56,6 +56,10 @@ class Master(Root, item_base.Master):
         super(Master, self).__init__(parent, item)
         self._created        = True
 
+    def getSnapshotBuffer(self, parent_id):
+        # The root item always exists on the slaves
+        return self._getSubItemsSnapshot()
+
 class Slave(Root, item_base.Slave):
     def __init__(self, parent, buffer):
         super(Slave, self).__init__(parent, buffer)
@@ -48,11 +48,30 @@ class Scene:
     def _getSubItems(self):
         return list(self._item.objects)
 
+    def _getSubItemsState(self):
+        # Objects are appended at the end of the list: its length and its
+        # last object are enough to know if the list changed
+        objects = self._item.objects
+        if len(objects) > 0:
+            return (len(objects), id(objects[-1]))
+        return (0, None)
+
 class Master(Scene, item_base.Master):
     def __init__(self, parent, item):
         super(Master, self).__init__(parent, item)
         self._previousCamera = self._item.active_camera
         self._created        = False
+        self._objectsState   = None
+
+    def _subItemsChanged(self):
+        state = self._getSubItemsState()
+        if state == self._objectsState:
+            return False
+        self._objectsState = state
+        return True
+
+    def hasChanged(self):
+        return self._previousCamera != self._item.active_camera
 
     def getSynchronizerBuffer(self):
         buffer = blender_cave.buffer.Buffer()
@@ -61,6 +80,11 @@ class Master(Scene, item_base.Master):
             buffer.string(str(self._previousCamera))
         return buffer
 
+    def getStateBuffer(self):
+        buffer = blender_cave.buffer.Buffer()
+        buffer.string(str(self._previousCamera))
+        return buffer
+
 class Slave(Scene, item_base.Slave):
     def __init__(self, parent, buffer):
         super(Slave, self).__init__(parent, buffer)
@@ -69,6 +93,7 @@ class Slave(Scene, item_base.Slave):
         item = super(Slave, self).getItemByName(name, parent_name)
         if item is None:
             item = self._item.addObject(name, parent_name)
+            self._addToIndex(item)
         return item
 
     def processSynchronizerBuffer(self, buffer):
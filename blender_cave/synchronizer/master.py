@@ -34,66 +34,192 @@
 ## 
 
 import copy
+import collections
 import bge
 import blender_cave.base
 import blender_cave.exceptions
 from . import Synchronizer
 from . import item_base
+from . import transforms
 
 class Master(Synchronizer):
-    def __init__(self, parent):
-        super(Master, self).__init__(parent)
+
+    # Number of items checked for deletion at each frame
+    LIVENESS_CHECKS = 256
+    # Frames before the ID of a deleted item identifies a new one : the datagrams of the previous frames may still refer to it
+    ID_REUSE_DELAY  = transforms.Master.HISTORY
+
+    def __init__(self, parent, config):
+        super(Master, self).__init__(parent, config)
+        # Item ID -> synchronizer item, and id() of the blender item -> item ID
         self._items            = {}
-        self._active           = []
+        self._objects          = {}
+        # Dense item IDs (0 is the root item) : the IDs of the deleted items are reused in the order they were freed
+        self._next_id          = 1
+        self._free_ids         = collections.deque()
+        self._frame            = 0
+        self._active           = collections.OrderedDict()
+        # Active items whose hasChanged is checked at each frame
+        self._polled           = collections.OrderedDict()
+        self._dirty            = set()
+        self._dead             = set()
+        self._liveness         = collections.deque()
+        self._transforms       = transforms.Master(self, config['encoding'], config.get('channel', transforms.CHANNEL_RELIABLE))
         self._mainItem         = self.getItem(bge.logic)
         self._firstCreation     = True
 
     def _activateItem(self, synchronizerItem, activate):
         if synchronizerItem.isSynchronizable():
             if activate:
-                self._active.append(synchronizerItem.getItemID())
-            else:
-                try:
-                    self._active.remove(synchronizerItem.getItemID())
-                except ValueError:
-                    pass
+                self._active[synchronizerItem.getItemID()] = synchronizerItem
+                self._dirty.add(synchronizerItem.getItemID())
+                if synchronizerItem.isPolled():
+                    self._polled[synchronizerItem.getItemID()] = synchronizerItem
+                if synchronizerItem.hasTransforms():
+                    self._transforms.add(synchronizerItem.getItemID(), synchronizerItem)
+            elif self._active.get(synchronizerItem.getItemID()) is synchronizerItem:
+                # Not an item deleted since : its ID may identify a new one
+                del(self._active[synchronizerItem.getItemID()])
+                self._polled.pop(synchronizerItem.getItemID(), None)
+                self._transforms.remove(synchronizerItem.getItemID())
 
     def getItem(self, item):
-        item_id = id(item)
-        if item_id not in self._items:
-            synchronizerItem = self._createSynchronizerItem(item)
-            self._items[item_id] = synchronizerItem
+        try:
+            return self._items[self._objects[id(item)]]
+        except KeyError:
+            pass
+        synchronizerItem = self._createSynchronizerItem(item)
+        if synchronizerItem.getItemID() is None:
+            synchronizerItem.setItemID(self._allocateItemID())
+        item_id = synchronizerItem.getItemID()
+        self._items[item_id]    = synchronizerItem
+        self._objects[id(item)] = item_id
+        self._liveness.append(synchronizerItem)
+        return synchronizerItem
+
+    def findItem(self, item):
+        """Get the synchronizer item of item, without creating it"""
+        item_id = self._objects.get(id(item))
+        if item_id is None:
+            return None
         return self._items[item_id]
 
-    def getSynchronizerBuffer(self):
+    def _allocateItemID(self):
+        if (len(self._free_ids) > 0) and (self._free_ids[0][0] <= self._frame - self.ID_REUSE_DELAY):
+            return self._free_ids.popleft()[1]
+        item_id = self._next_id
+        self._next_id += 1
+        return item_id
 
-        buffer = blender_cave.buffer.Buffer()
+    def markDirty(self, item):
+        """Force the synchronization of this item at next frame
+
+        Usefull for items whose changes are not detected by their snapshot (ie. : items that are not polled)"""
+        item_id = self._objects.get(id(item))
+        if item_id is not None:
+            self._dirty.add(item_id)
 
-        items_to_delete = []
-        for item_id in self._items:
-            item = self._items[item_id]
+    def _checkLiveness(self):
+        # Amortize the deletion detection over several frames: each item is checked once every len(self._items) / LIVENESS_CHECKS frames
+        for index in range(min(self.LIVENESS_CHECKS, len(self._liveness))):
+            item = self._liveness.popleft()
+            if self._items.get(item.getItemID()) is not item:
+                # Already deleted
+                continue
+            if item.isAlive():
+                self._liveness.append(item)
+            else:
+                self._dead.add(item.getItemID())
+
+    def _collectDirty(self):
+        dirty       = self._dirty
+        self._dirty = set()
+        for item_id, item in self._polled.items():
+            if item_id in dirty:
+                continue
             try:
-                str(item.getItem())
+                if item.hasChanged():
+                    dirty.add(item_id)
             except SystemError:
-                items_to_delete.append(item_id)
-        for item_id in items_to_delete:
+                # The BGE object has been freed
+                self._dead.add(item_id)
+        return dirty
+
+    def getSynchronizerBuffer(self):
+
+        buffer = blender_cave.buffer.Buffer()
+
+        self._frame += 1
+        self._checkLiveness()
+        for item_id in self._dead:
+            if item_id not in self._items:
+                continue
             buffer.command(self.DELETE_ITEM)
             buffer.itemID(item_id)
-            del(self._items[item_id])
+            item = self._items.pop(item_id)
+            self._objects.pop(id(item.getItem()), None)
+            self._active.pop(item_id, None)
+            self._polled.pop(item_id, None)
+            self._transforms.remove(item_id)
+            self._dirty.discard(item_id)
+            self._free_ids.append((self._frame, item_id))
+        self._dead.clear()
 
         buffer += self._mainItem.getCreationBuffer(0)
 
-        for item_id in self._active:
+        # Polled after the creation, so newly activated items are sent at once
+        transforms_buffer, dead = self._transforms.getBuffer()
+        self._dead.update(dead)
+        if transforms_buffer is not None:
+            buffer.command(self.TRANSFORMS)
+            buffer.subBuffer(transforms_buffer)
+
+        dirty = self._collectDirty()
+
+        for item_id in dirty:
+            item = self._active.get(item_id)
+            if item is None:
+                continue
             try:
-                item = self._items[item_id]
                 item_buffer = item.getSynchronizerBuffer()
-                if len(item_buffer) > 0:
-                    buffer.command(self.SET_ATTRIBUTE)
-                    buffer.itemID(item_id)
-                    buffer.subBuffer(item_buffer)
-            except KeyError:
-                pass
+            except SystemError:
+                self._dead.add(item_id)
+                continue
+            if len(item_buffer) > 0:
+                buffer.command(self.SET_ATTRIBUTE)
+                buffer.itemID(item_id)
+                buffer.subBuffer(item_buffer)
 
         self._firstCreation = False
 
         return buffer
+
+    def getDatagramBuffer(self, frame, baseline):
+        """Get the transformations of the last frame for the datagram channel (None if they are inside the frames)"""
+        if self._config.get('channel') != transforms.CHANNEL_DATAGRAM:
+            return None
+        return self._transforms.getDatagramBuffer(frame, baseline)
+
+    def getSnapshotBuffer(self):
+        """Get the state sent until the last frame, for a slave that joins during the simulation
+
+        The next frames are computed against this state, so it must not include any pending change"""
+
+        buffer = self._mainItem.getSnapshotBuffer(0)
+
+        transforms_buffer = self._transforms.getSnapshotBuffer()
+        if transforms_buffer is not None:
+            buffer.command(self.TRANSFORMS)
+            buffer.subBuffer(transforms_buffer)
+
+        for item_id, item in self._active.items():
+            try:
+                item_buffer = item.getStateBuffer()
+            except SystemError:
+                continue
+            if len(item_buffer) > 0:
+                buffer.command(self.SET_ATTRIBUTE)
+                buffer.itemID(item_id)
+                buffer.subBuffer(item_buffer)
+
+        return buffer
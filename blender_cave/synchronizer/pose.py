@@ -0,0 +1,260 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+"""Batched synchronization of the pose of an armature
+
+The master snapshots the fields of all the channels (bones) of the armature
+inside a single (channels x columns) float32 array and compares it to the
+previous one. The changed channels are grouped by mask (ie. : which fields
+changed) and each group is sent as : mask, count, count channel indexes
+(uint16), count rows holding only the changed fields (float32). Without
+numpy, the same format is produced and read with struct.
+
+The slave applies all the changed channels in one pass, then updates the
+armature once.
+
+Only a subset of the channels can be streamed : the ones that are not driven
+by the actions played on the slaves too."""
+
+import struct
+import collections
+import blender_cave.base
+import blender_cave.buffer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LOCATION       = 1
+SCALE          = 2
+ROTATION_MODE  = 4
+QUATERNION     = 8
+EULER          = 16
+JOINT_ROTATION = 32
+ALL            = LOCATION | SCALE | ROTATION_MODE | QUATERNION | EULER | JOINT_ROTATION
+
+# (flag, attribute of the channel, first column, number of columns) of the fields of a row
+FIELDS = ((LOCATION,       'location',             0, 3),
+          (SCALE,          'scale',                3, 3),
+          (ROTATION_MODE,  'rotation_mode',        6, 1),
+          (QUATERNION,     'rotation_quaternion',  7, 4),
+          (EULER,          'rotation_euler',      11, 3),
+          (JOINT_ROTATION, 'joint_rotation',      14, 3))
+WIDTH  = 17
+
+def getColumns(mask):
+    """Get the snapshot columns of the fields inside mask"""
+    columns = []
+    for flag, name, start, count in FIELDS:
+        if mask & flag:
+            columns.extend(range(start, start + count))
+    return columns
+
+_layouts = {}
+
+def _getLayout(mask):
+    """Get the struct of a row on the wire and the (attribute, offset, count) of its fields"""
+    try:
+        return _layouts[mask]
+    except KeyError:
+        pass
+    fields = []
+    offset = 0
+    for flag, name, start, count in FIELDS:
+        if mask & flag:
+            fields.append((name, offset, count))
+            offset += count
+    layout = (struct.Struct('>' + str(offset) + 'f'), fields)
+    _layouts[mask] = layout
+    return layout
+
+class Master(blender_cave.base.Base):
+
+    def __init__(self, parent, channels):
+        super(Master, self).__init__(parent)
+        self._all     = list(channels)
+        self._indexes = None
+        self.setStreamed(None)
+
+    def setStreamed(self, indexes):
+        """Only stream these channels (all of them if None)"""
+        if indexes is None:
+            indexes = range(len(self._all))
+        indexes = sorted(indexes)
+        if indexes == self._indexes:
+            return
+        self._indexes  = indexes
+        self._channels = [self._all[index] for index in indexes]
+        if numpy is not None:
+            self._indexes_array = numpy.array(indexes, dtype = numpy.int64)
+        # Last pose sent (None : the channels are sent as a whole), and the one taken by hasChanged, not sent yet
+        self._previous = None
+        self._current  = None
+
+    def hasChanged(self):
+        if len(self._channels) == 0:
+            return False
+        current = self._snapshot()
+        if self._previous is None:
+            changed = True
+        elif numpy is None:
+            changed = (current != self._previous)
+        else:
+            changed = bool((current != self._previous).any())
+        # Kept for getBuffer, called during the same frame
+        if changed:
+            self._current = current
+        else:
+            self._current = None
+        return changed
+
+    def getBuffer(self):
+        """Get the buffer of the channels that changed since the previous call"""
+        if len(self._channels) == 0:
+            return blender_cave.buffer.Buffer()
+        if self._current is None:
+            current = self._snapshot()
+        else:
+            current = self._current
+        self._current = None
+        if numpy is None:
+            groups = self._diffPython(current)
+        else:
+            groups = self._diffNumpy(current)
+        self._previous = current
+        return self._getGroupsBuffer(groups)
+
+    def getStateBuffer(self):
+        """Get the buffer of all the streamed channels, as last sent"""
+        if (self._previous is None) or (len(self._previous) == 0):
+            return blender_cave.buffer.Buffer()
+        if numpy is None:
+            indexes = list(range(len(self._previous)))
+        else:
+            indexes = numpy.arange(len(self._previous))
+        return self._getGroupsBuffer([(ALL, indexes, self._packRows(ALL, self._previous, indexes))])
+
+    def _snapshot(self):
+        if numpy is None:
+            rows = []
+            for channel in self._channels:
+                rows.append(tuple(channel.location) + tuple(channel.scale) + (channel.rotation_mode,) +
+                            tuple(channel.rotation_quaternion) + tuple(channel.rotation_euler) + tuple(channel.joint_rotation))
+            return rows
+        count    = len(self._channels)
+        snapshot = numpy.empty((count, WIDTH), dtype = numpy.float32)
+        for flag, name, start, width in FIELDS:
+            snapshot[:, start:start + width] = numpy.array([getattr(channel, name) for channel in self._channels], dtype = numpy.float32).reshape(count, width)
+        return snapshot
+
+    def _packRows(self, mask, rows, indexes):
+        columns = getColumns(mask)
+        if numpy is None:
+            format = _getLayout(mask)[0]
+            return b''.join([format.pack(*[rows[index][column] for column in columns]) for index in indexes])
+        return rows[indexes][:, columns].astype('>f4').tobytes()
+
+    def _diffNumpy(self, current):
+        if self._previous is None:
+            masks = numpy.full(len(current), ALL, dtype = numpy.uint8)
+        else:
+            different = (current != self._previous)
+            masks     = numpy.zeros(len(current), dtype = numpy.uint8)
+            for flag, name, start, width in FIELDS:
+                masks[different[:, start:start + width].any(axis = 1)] |= flag
+        groups = []
+        for mask in numpy.unique(masks[masks != 0]):
+            indexes = numpy.nonzero(masks == mask)[0]
+            groups.append((int(mask), indexes, self._packRows(int(mask), current, indexes)))
+        return groups
+
+    def _diffPython(self, current):
+        groups = collections.OrderedDict()
+        for index, row in enumerate(current):
+            if self._previous is None:
+                mask = ALL
+            else:
+                previous = self._previous[index]
+                mask     = 0
+                for flag, name, start, width in FIELDS:
+                    if row[start:start + width] != previous[start:start + width]:
+                        mask |= flag
+            if mask != 0:
+                groups.setdefault(mask, []).append(index)
+        return [(mask, indexes, self._packRows(mask, current, indexes)) for mask, indexes in groups.items()]
+
+    def _getGroupsBuffer(self, groups):
+        # The rows of the snapshot are the streamed channels only
+        buffer = blender_cave.buffer.Buffer()
+        for mask, rows, values in groups:
+            buffer.unsigned_char(mask)
+            buffer.size(len(rows))
+            if numpy is None:
+                buffer.raw(struct.pack('>' + str(len(rows)) + 'H', *[self._indexes[row] for row in rows]))
+            else:
+                buffer.raw(self._indexes_array[rows].astype('>u2').tobytes())
+            buffer.raw(values)
+        return buffer
+
+class Slave(blender_cave.base.Base):
+
+    def __init__(self, parent, armature):
+        super(Slave, self).__init__(parent)
+        self._armature = armature
+
+    def process(self, buffer):
+        """Apply the changed channels, then update the armature"""
+        channels = self._armature.channels
+        number   = len(channels)
+        while not buffer.isEmpty():
+            mask           = buffer.unsigned_char()
+            count          = buffer.size()
+            indexes        = struct.unpack('>' + str(count) + 'H', buffer.raw(size = 2 * count))
+            format, fields = _getLayout(mask)
+            data           = buffer.raw(size = count * format.size)
+            for position, index in enumerate(indexes):
+                if index >= number:
+                    continue
+                row     = format.unpack_from(data, position * format.size)
+                channel = channels[index]
+                for name, offset, width in fields:
+                    if width == 1:
+                        # rotation_mode
+                        setattr(channel, name, int(row[offset]))
+                    else:
+                        setattr(channel, name, row[offset:offset + width])
+        self._armature.update()
@@ -38,55 +38,108 @@ import bge
 import blender_cave.base
 import blender_cave.exceptions
 from . import Synchronizer
+from . import transforms
 
 class Slave(Synchronizer):
-    def __init__(self, parent):
-        super(Slave, self).__init__(parent) 
+    def __init__(self, parent, config):
+        super(Slave, self).__init__(parent, config)
 
-        self._items            = {}
+        # Indexed by the item IDs, dense on the master (None for the deleted items)
+        self._items            = []
 
         self._not_object_items = {}
 
-        self._items[0] = self._createSynchronizerItem(bge.logic)
+        self._transforms       = transforms.Slave(self, config.get('smoothing', transforms.SMOOTHING_NONE))
+        # The transformations come from the datagrams : the frames only hold the snapshots
+        self._datagram         = (config.get('channel') == transforms.CHANNEL_DATAGRAM)
+
+        self._setItem(0, self._createSynchronizerItem(bge.logic))
+
+    def _getItem(self, item_id):
+        if item_id < len(self._items):
+            return self._items[item_id]
+        return None
+
+    def _setItem(self, item_id, item):
+        if item_id >= len(self._items):
+            self._items.extend([None] * (item_id + 1 - len(self._items)))
+        self._items[item_id] = item
 
     def processSynchronizerBuffer(self, buffer):
+        self.processSynchronizerBuffers([buffer])
+
+    def processSynchronizerBuffers(self, buffers):
+        """Apply the frames received since the last rendering
+
+        Creations, deletions and attributes are applied in order, but only the
+        last transformations of each item are applied, at the end"""
 
-        while len(buffer) > 0:
+        if not self._datagram:
+            self._transforms.beginFrame(self.getBlenderCave().getFrameTime())
+
+        for buffer in buffers:
+            while len(buffer) > 0:
             
-            command = buffer.command()
-
-            if command == self.DELETE_ITEM:
-                item_id   = buffer.itemID()
-                try:
-                    del(self._items[item_id])
-                except KeyError:
-                    pass
-                continue
-
-            if command == self.CREATE_ITEM:
-                parent_id   = buffer.itemID()
-                item_id     = buffer.itemID()
-                item_name   = buffer.string()
-                parent_name = buffer.string()
-                try:
-                    parent_item = self._items[parent_id]
-                except KeyError:
+                command = buffer.command()
+
+                if command == self.DELETE_ITEM:
+                    item_id   = buffer.itemID()
+                    if item_id < len(self._items):
+                        self._items[item_id] = None
+                    self._transforms.remove(item_id)
+                    continue
+
+                if command == self.CREATE_ITEM:
+                    parent_id   = buffer.itemID()
+                    item_id     = buffer.itemID()
+                    item_name   = buffer.string()
+                    parent_name = buffer.string()
+                    parent_item = self._getItem(parent_id)
+                    if parent_item is None:
+                        continue
+                    item = parent_item.getItemByName(item_name, parent_name)
+                    self._setItem(item_id, self._createSynchronizerItem(item))
                     continue
-                item = parent_item.getItemByName(item_name, parent_name)
-                self._items[item_id] = self._createSynchronizerItem(item)
-                continue
-
-            if command == self.SET_ATTRIBUTE:
-                item_id     = buffer.itemID()
-                item_buffer = buffer.subBuffer()
-                try:
-                    item = self._items[item_id]
-                    item.processSynchronizerBuffer(item_buffer)
-                except KeyError:
-                    pass
-                except:
-                    self.getBlenderCave().log_traceback(False)
-                continue
-
-            raise blender_cave.exceptions.Synchronizer("buffer from master reading error: not start of item !")
+
+                if command == self.TRANSFORMS:
+                    self._transforms.process(buffer.subBuffer(), self._items)
+                    continue
+
+                if command == self.SET_ATTRIBUTE:
+                    item_id     = buffer.itemID()
+                    item_buffer = buffer.subBuffer()
+                    # Keep the order of the changes of this item
+                    self._transforms.flush(self._items, item_id)
+                    item = self._getItem(item_id)
+                    if item is None:
+                        continue
+                    try:
+                        item.processSynchronizerBuffer(item_buffer)
+                    except:
+                        self.getBlenderCave().log_traceback(False)
+                    continue
+
+                raise blender_cave.exceptions.Synchronizer("buffer from master reading error: not start of item !")
+
+        if self._datagram:
+            self._transforms.flush(self._items)
+        else:
+            self._transforms.endFrame(self._items)
         return
+
+    def processHeartbeat(self):
+        """The master sent a frame without any change : the moving items stopped"""
+        if not self._datagram:
+            # Otherwise, the datagram of this frame tells it
+            self._transforms.settle(self.getBlenderCave().getFrameTime())
+
+    def processDatagramBuffer(self, frame, buffer):
+        """Apply the transformations of a datagram frame. Return False if it cannot be used"""
+        if not self._transforms.processDatagram(frame, buffer, self._items):
+            return False
+        self._transforms.beginFrame(self.getBlenderCave().getFrameTime())
+        self._transforms.endFrame(self._items)
+        return True
+
+    def preRender(self):
+        self._transforms.render(self._items)
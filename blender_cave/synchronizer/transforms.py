@@ -0,0 +1,894 @@
+## Copyright © LIMSI-CNRS (2013)
+##
+## contributor(s) : Jorge Gascon, Damien Touraine, David Poirier-Quinot,
+## Laurent Pointal, Julian Adenauer, 
+## 
+## This software is a computer program whose purpose is to distribute
+## blender to render on CAVE(TM) device systems.
+## 
+## This software is governed by the CeCILL  license under French law and
+## abiding by the rules of distribution of free software.  You can  use, 
+## modify and/ or redistribute the software under the terms of the CeCILL
+## license as circulated by CEA, CNRS and INRIA at the following URL
+## "http://www.cecill.info". 
+## 
+## As a counterpart to the access to the source code and  rights to copy,
+## modify and redistribute granted by the license, users are provided only
+## with a limited warranty  and the software's author,  the holder of the
+## economic rights,  and the successive licensors  have only  limited
+## liability. 
+## 
+## In this respect, the user's attention is drawn to the risks associated
+## with loading,  using,  modifying and/or developing or reproducing the
+## software by the user in light of its specific status of free software,
+## that may mean  that it is complicated to manipulate,  and  that  also
+## therefore means  that it is reserved for developers  and  experienced
+## professionals having in-depth computer knowledge. Users are therefore
+## encouraged to load and test the software's suitability as regards their
+## requirements in conditions enabling the security of their systems and/or 
+## data to be ensured and,  more generally, to use and operate it in the 
+## same conditions as regards security. 
+## 
+## The fact that you are presently reading this means that you have had
+## knowledge of the CeCILL license and that you accept its terms.
+## 
+
+
+"""Batched synchronization of the transformations of the objects
+
+The master snapshots the world position, orientation and scale of all the
+active objects inside a single (objects x columns) array and compares it to
+the previous one in a single operation. The changed rows are grouped by mask
+(ie. : which transformations changed and how they are encoded) and each group
+is sent as : mask, count, count item IDs, count rows. Without numpy, the same
+format is produced and read with struct.
+
+The objects whose parent is also synchronized are sent in the space of their
+parent (local position, orientation and scale) : moving the parent does not
+change them, and the slaves get their world transformations through their own
+scene graph. Their groups are flagged LOCAL and hold the item IDs of the
+parents after the item IDs. An object whose parent changes is sent again
+whole.
+
+Two encodings are available :
+ - float   : position, orientation matrix and scale as float32 (60 bytes for
+             a full row)
+ - compact : fixed-point position (int16 delta from the previous one, or
+             int32 absolute value), orientation as a smallest-three quantized
+             quaternion and scale as float32 (25 bytes for a full row, 10
+             bytes for a moving and rotating object)
+
+They are sent inside the reliable frames (default), or on the datagram
+channel : each datagram holds, as absolute values, the transformations that
+changed since a baseline frame that every slave received, so a lost datagram
+is simply replaced by the next one.
+
+On the slaves, the frames received since the last rendering are merged : only
+the last transformations of each item are applied. They can be applied at
+once (default), or smoothed at each rendering, using the timestamps of the
+frames :
+ - interpolate : render one master frame late, between the two last states
+ - extrapolate : dead-reckon from the two last states, up to one more frame"""
+
+import math
+import time
+import struct
+import collections
+import mathutils
+import blender_cave.base
+import blender_cave.buffer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+POSITION    = 1
+ORIENTATION = 2
+SCALE       = 4
+# Compact encoding : positions are int16 deltas from the previous ones instead of absolute int32
+DELTA       = 8
+COMPACT     = 16
+# Transformations relative to the parent item, whose IDs follow the item IDs
+LOCAL       = 32
+
+ENCODING_FLOAT   = 'float'
+ENCODING_COMPACT = 'compact'
+
+CHANNEL_RELIABLE = 'reliable'
+CHANNEL_DATAGRAM = 'datagram'
+
+SMOOTHING_NONE        = 'none'
+SMOOTHING_INTERPOLATE = 'interpolate'
+SMOOTHING_EXTRAPOLATE = 'extrapolate'
+
+# Compact encoding : fixed-point position step (in blender units)
+POSITION_STEP  = 1.0 / 4096
+DELTA_LIMIT    = 0x7FFF
+# Compact encoding : the three smallest quaternion components are in [-1/sqrt(2), 1/sqrt(2)]
+QUATERNION_MAX = 0x7FFF * math.sqrt(2.0)
+
+def getColumns(mask):
+    """Get the snapshot columns of the transformations inside mask"""
+    if mask & COMPACT:
+        columns = ((POSITION, 0, 3), (ORIENTATION, 3, 7), (SCALE, 7, 10))
+    else:
+        columns = ((POSITION, 0, 3), (ORIENTATION, 3, 12), (SCALE, 12, 15))
+    result = []
+    for flag, start, end in columns:
+        if mask & flag:
+            result.extend(range(start, end))
+    return result
+
+def getRowFields(mask):
+    """Get the (struct type, count) fields of a row on the wire"""
+    fields = []
+    if mask & COMPACT:
+        if mask & POSITION:
+            if mask & DELTA:
+                fields.append(('h', 3))
+            else:
+                fields.append(('i', 3))
+        if mask & ORIENTATION:
+            fields.append(('B', 1))
+            fields.append(('h', 3))
+    else:
+        if mask & POSITION:
+            fields.append(('f', 3))
+        if mask & ORIENTATION:
+            fields.append(('f', 9))
+    if mask & SCALE:
+        fields.append(('f', 3))
+    return fields
+
+def getRowFormat(mask):
+    return '>' + ''.join([str(count) + type for type, count in getRowFields(mask)])
+
+NUMPY_TYPES = {'h' : '>i2',
+               'i' : '>i4',
+               'B' : 'u1',
+               'f' : '>f4'}
+
+def _getNumpyType(mask):
+    return numpy.dtype([('f' + str(index), NUMPY_TYPES[type], (count,)) for index, (type, count) in enumerate(getRowFields(mask))])
+
+def _selectColumns(rows, columns):
+    if numpy is None:
+        return [[row[column] for column in columns] for row in rows]
+    return rows[:, columns]
+
+def packRows(mask, rows):
+    if numpy is None:
+        format = struct.Struct(getRowFormat(mask))
+        return b''.join([format.pack(*row) for row in rows])
+    dtype  = _getNumpyType(mask)
+    packed = numpy.empty(len(rows), dtype = dtype)
+    column = 0
+    for name in dtype.names:
+        width = dtype[name].shape[0]
+        packed[name] = rows[:, column:column + width]
+        column += width
+    return packed.tobytes()
+
+def unpackRows(mask, count, buffer):
+    format = struct.Struct(getRowFormat(mask))
+    data   = buffer.raw(size = count * format.size)
+    if numpy is None:
+        return [format.unpack_from(data, index * format.size) for index in range(count)]
+    packed = numpy.frombuffer(data, dtype = _getNumpyType(mask))
+    return numpy.hstack([packed[name].astype(numpy.float64) for name in packed.dtype.names]).tolist()
+
+def _smallestThree(quaternion):
+    # quaternion : (w, x, y, z) normalized. Return index of the largest component and the three others, quantized
+    largest = max(range(4), key = lambda index: abs(quaternion[index]))
+    sign    = -1.0 if quaternion[largest] < 0 else 1.0
+    others  = [int(round(sign * quaternion[index] * QUATERNION_MAX)) for index in range(4) if index != largest]
+    return [largest] + [max(-0x7FFF, min(0x7FFF, other)) for other in others]
+
+def _getItem(items, item_id):
+    # The slaves hold their items in a list indexed by the item IDs
+    if item_id < len(items):
+        return items[item_id]
+    return None
+
+def _lerp(start, end, factor):
+    return [a + (b - a) * factor for a, b in zip(start, end)]
+
+def _slerp(start, end, factor):
+    # Quaternions as (w, x, y, z). Not clamped : factor above 1 extrapolates the rotation
+    dot = sum([a * b for a, b in zip(start, end)])
+    if dot < 0:
+        end = [-value for value in end]
+        dot = -dot
+    if dot > 0.9995:
+        result = _lerp(start, end, factor)
+    else:
+        angle  = math.acos(min(1.0, dot))
+        sine   = math.sin(angle)
+        a      = math.sin((1.0 - factor) * angle) / sine
+        b      = math.sin(factor * angle) / sine
+        result = [a * x + b * y for x, y in zip(start, end)]
+    norm = math.sqrt(sum([value * value for value in result]))
+    return [value / norm for value in result]
+
+def _getAttributes(local):
+    # Names of the position, orientation and scale of the objects, in world or parent space
+    if local:
+        return ('localPosition', 'localOrientation', 'localScale')
+    return ('worldPosition', 'worldOrientation', 'worldScale')
+
+def _fromSmallestThree(row):
+    others  = [value / QUATERNION_MAX for value in row[1:4]]
+    largest = math.sqrt(max(0.0, 1.0 - sum([other * other for other in others])))
+    others.insert(int(row[0]), largest)
+    return mathutils.Quaternion(others).to_matrix()
+
+class Float:
+    """World position, orientation matrix and scale as float32"""
+
+    FLAG  = 0
+    WIDTH = 15
+
+    def snapshot(self, objects, local = False):
+        position, orientation, scale = _getAttributes(local)
+        if numpy is None:
+            rows = []
+            for object in objects:
+                matrix = getattr(object, orientation)
+                rows.append(tuple(getattr(object, position)) + tuple(matrix[0]) + tuple(matrix[1]) + tuple(matrix[2]) + tuple(getattr(object, scale)))
+            return rows
+        count    = len(objects)
+        snapshot = numpy.empty((count, self.WIDTH), dtype = numpy.float32)
+        snapshot[:,  0: 3] = [getattr(object, position) for object in objects]
+        snapshot[:,  3:12] = numpy.array([getattr(object, orientation) for object in objects], dtype = numpy.float32).reshape(count, 9)
+        snapshot[:, 12:15] = [getattr(object, scale) for object in objects]
+        return snapshot
+
+    def pack(self, mask, rows, previous):
+        """Get a list of (wire mask, indexes of the rows, packed rows). None as indexes means all rows"""
+        return [(mask, None, packRows(mask, _selectColumns(rows, getColumns(mask))))]
+
+class Compact:
+    """Fixed-point positions (as deltas when possible) and smallest-three quantized quaternions"""
+
+    FLAG  = COMPACT
+    WIDTH = 10
+
+    def snapshot(self, objects, local = False):
+        position, orientation, scale = _getAttributes(local)
+        if numpy is None:
+            rows = []
+            for object in objects:
+                fixed = [int(round(value / POSITION_STEP)) for value in getattr(object, position)]
+                quaternion = getattr(object, orientation).to_quaternion()
+                quaternion.normalize()
+                rows.append(tuple(fixed) + tuple(_smallestThree(quaternion)) + tuple(struct.unpack('>3f', struct.pack('>3f', *getattr(object, scale)))))
+            return rows
+        count    = len(objects)
+        snapshot = numpy.empty((count, self.WIDTH), dtype = numpy.float64)
+        snapshot[:, 0: 3] = numpy.round(numpy.array([getattr(object, position) for object in objects], dtype = numpy.float64) / POSITION_STEP)
+        snapshot[:, 3: 7] = self._smallestThree(numpy.array([getattr(object, orientation) for object in objects], dtype = numpy.float64))
+        snapshot[:, 7:10] = numpy.array([getattr(object, scale) for object in objects], dtype = numpy.float32)
+        return snapshot
+
+    def _smallestThree(self, matrices):
+        m = matrices
+        quaternions = 0.5 * numpy.sqrt(numpy.maximum(0.0, numpy.stack([1.0 + m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2],
+                                                                        1.0 + m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2],
+                                                                        1.0 - m[:, 0, 0] + m[:, 1, 1] - m[:, 2, 2],
+                                                                        1.0 - m[:, 0, 0] - m[:, 1, 1] + m[:, 2, 2]], axis = 1)))
+        quaternions[:, 1] = numpy.copysign(quaternions[:, 1], m[:, 2, 1] - m[:, 1, 2])
+        quaternions[:, 2] = numpy.copysign(quaternions[:, 2], m[:, 0, 2] - m[:, 2, 0])
+        quaternions[:, 3] = numpy.copysign(quaternions[:, 3], m[:, 1, 0] - m[:, 0, 1])
+        quaternions /= numpy.linalg.norm(quaternions, axis = 1)[:, numpy.newaxis]
+        rows    = numpy.arange(len(quaternions))
+        largest = numpy.argmax(numpy.abs(quaternions), axis = 1)
+        quaternions *= numpy.where(quaternions[rows, largest] < 0, -1.0, 1.0)[:, numpy.newaxis]
+        others  = numpy.ones(quaternions.shape, dtype = bool)
+        others[rows, largest] = False
+        others  = numpy.clip(numpy.round(quaternions[others].reshape(-1, 3) * QUATERNION_MAX), -0x7FFF, 0x7FFF)
+        return numpy.column_stack((largest, others))
+
+    def pack(self, mask, rows, previous):
+        mask   |= COMPACT
+        columns = getColumns(mask)
+        if not (mask & POSITION):
+            return [(mask, None, packRows(mask, _selectColumns(rows, columns)))]
+        if numpy is None:
+            result = {mask : [], mask | DELTA : []}
+            for index, (row, old) in enumerate(zip(rows, previous)):
+                values = [row[column] for column in columns]
+                if old is not None:
+                    delta = [row[column] - old[column] for column in range(3)]
+                    if max([abs(value) for value in delta]) <= DELTA_LIMIT:
+                        result[mask | DELTA].append((index, delta + values[3:]))
+                        continue
+                result[mask].append((index, values))
+            return [(wire_mask, [index for index, values in packed], packRows(wire_mask, [values for index, values in packed]))
+                    for wire_mask, packed in result.items() if len(packed) > 0]
+        values = rows[:, columns]
+        delta  = rows[:, 0:3] - previous[:, 0:3]
+        # NaN (ie. : unknown previous position) is never lower than the limit
+        fit    = numpy.all(numpy.abs(delta) <= DELTA_LIMIT, axis = 1)
+        result = []
+        if fit.any():
+            deltas = values[fit]
+            deltas[:, 0:3] = delta[fit]
+            result.append((mask | DELTA, numpy.nonzero(fit)[0], packRows(mask | DELTA, deltas)))
+        if not fit.all():
+            result.append((mask, numpy.nonzero(~fit)[0], packRows(mask, values[~fit])))
+        return result
+
+class Master(blender_cave.base.Base):
+
+    # Number of frames kept as possible baselines of the datagrams
+    HISTORY = 64
+
+    def __init__(self, parent, encoding = ENCODING_FLOAT, channel = CHANNEL_RELIABLE):
+        super(Master, self).__init__(parent)
+        if encoding == ENCODING_COMPACT:
+            self._encoding = Compact()
+        else:
+            self._encoding = Float()
+        self._channel  = channel
+        self._members  = collections.OrderedDict()
+        self._ids      = []
+        self._items    = []
+        self._previous = []
+        self._changed  = False
+        # Parent object and parent item ID (0 : world space) of each row, rows in the space of their parent,
+        # and item ID -> parent item ID of these items
+        self._parents   = []
+        self._parentIDs = []
+        self._spaces    = {}
+        self._updateLocal()
+        # Datagram channel : IDs of the items that changed at each of the last frames, and since the last datagram
+        self._history  = collections.OrderedDict()
+        self._moved    = []
+        self._updateRows()
+
+    def add(self, item_id, item):
+        if item_id not in self._members:
+            self._members[item_id] = item
+            self._changed = True
+
+    def remove(self, item_id):
+        if self._members.pop(item_id, None) is not None:
+            self._changed = True
+        self._spaces.pop(item_id, None)
+
+    def getBuffer(self):
+        """Get the buffer of the changed transformations (None if nothing changed) and the IDs of the freed items"""
+        dead = []
+        self._updateLayout()
+        try:
+            current = self._snapshot()
+        except SystemError:
+            # At least one BGE object has been freed
+            dead = [item_id for item_id, item in zip(self._ids, self._items) if not item.isAlive()]
+            for item_id in dead:
+                self.remove(item_id)
+            self._updateLayout()
+            current = self._snapshot()
+        if len(current) == 0:
+            return None, dead
+        if self._channel == CHANNEL_DATAGRAM:
+            # Sent by getDatagramBuffer : only keep which items changed
+            self._moved.append(self._getChangedIDs(current))
+            self._previous = current
+            return None, dead
+        if numpy is None:
+            groups = self._diffPython(current)
+        else:
+            groups = self._diffNumpy(current)
+        self._previous = current
+        return self._getGroupsBuffer(groups), dead
+
+    def getSnapshotBuffer(self):
+        """Get the buffer of the transformations sent until the last frame, as absolute values (None if there is none)"""
+        if len(self._previous) == 0:
+            return None
+        if numpy is None:
+            indexes = [index for index, row in enumerate(self._previous) if row is not None]
+        else:
+            indexes = numpy.nonzero(~numpy.isnan(self._previous).any(axis = 1))[0]
+        return self._getAbsoluteBuffer(indexes)
+
+    def getDatagramBuffer(self, frame, baseline):
+        """Get the buffer of the baseline frame and of the transformations of the last frame that changed since it, as absolute values
+
+        The baseline is a previous frame received by every slave. If it is not known anymore, the empty state (0) is used.
+        The items that changed since the baseline are sent even if they came back to their value of the baseline : a
+        slave may have applied a later frame"""
+        if baseline not in self._history:
+            baseline = 0
+        if numpy is None:
+            self._history[frame] = set().union(*self._moved)
+        elif len(self._moved) > 0:
+            self._history[frame] = numpy.concatenate(self._moved)
+        else:
+            self._history[frame] = numpy.empty(0, dtype = numpy.int64)
+        self._moved = []
+        for old in [old for old in self._history if old < baseline]:
+            del(self._history[old])
+        while len(self._history) > self.HISTORY:
+            self._history.popitem(last = False)
+        if baseline == 0:
+            if numpy is None:
+                indexes = list(range(len(self._ids)))
+            else:
+                indexes = numpy.arange(len(self._ids))
+        else:
+            moved = [ids for old, ids in self._history.items() if old > baseline]
+            if numpy is None:
+                rows    = self._rows
+                indexes = sorted([rows[item_id] for item_id in set().union(*moved) if item_id in rows])
+            else:
+                ids     = numpy.unique(numpy.concatenate(moved))
+                # The IDs of the items removed since are not inside the layout anymore
+                ids     = ids[ids < len(self._rows)]
+                indexes = self._rows[ids]
+                indexes = indexes[indexes >= 0]
+        # Even without any change : the slaves need this frame as baseline of the next ones
+        buffer = blender_cave.buffer.Buffer()
+        buffer.integer(baseline)
+        groups = self._getAbsoluteBuffer(indexes)
+        if groups is not None:
+            buffer += groups
+        return buffer
+
+    def _getAbsoluteBuffer(self, indexes):
+        if len(indexes) == 0:
+            return None
+        if numpy is None:
+            spaces = [[index for index in indexes if self._local[index] == local] for local in (False, True)]
+        else:
+            spaces = [indexes[self._local[indexes] == local] for local in (False, True)]
+        groups = []
+        for space, space_indexes in zip((0, LOCAL), spaces):
+            if len(space_indexes) == 0:
+                continue
+            mask = POSITION | ORIENTATION | SCALE | space
+            if numpy is None:
+                rows    = [self._previous[index] for index in space_indexes]
+                unknown = [None] * len(rows)
+            else:
+                rows    = self._previous[space_indexes]
+                unknown = numpy.full(rows.shape, numpy.nan)
+            # Unknown previous rows : the compact encoding does not use any delta
+            for wire_mask, subset, values in self._encoding.pack(mask, rows, unknown):
+                if subset is None:
+                    subset = space_indexes
+                elif numpy is None:
+                    subset = [space_indexes[index] for index in subset]
+                else:
+                    subset = space_indexes[subset]
+                if numpy is None:
+                    groups.append((wire_mask, [self._ids[index] for index in subset], values))
+                else:
+                    groups.append((wire_mask, self._ids_array[subset].tolist(), values))
+        return self._getGroupsBuffer(groups)
+
+    def _getGroupsBuffer(self, groups):
+        if len(groups) == 0:
+            return None
+        buffer = blender_cave.buffer.Buffer()
+        for mask, ids, values in groups:
+            buffer.unsigned_char(mask)
+            buffer.size(len(ids))
+            buffer.itemIDs(ids)
+            if mask & LOCAL:
+                buffer.itemIDs([self._spaces[item_id] for item_id in ids])
+            buffer.raw(values)
+        return buffer
+
+    def _getChangedIDs(self, current):
+        if numpy is None:
+            return set([item_id for item_id, row, previous in zip(self._ids, current, self._previous) if row != previous])
+        # NaN (ie. : unknown previous row) is different from everything
+        return self._ids_array[(current != self._previous).any(axis = 1)]
+
+    def _updateLayout(self):
+        # Realign the previous snapshot on the new list of items. Rows of new items are unknown
+        if not self._changed:
+            return
+        old_indexes = dict((item_id, index) for index, item_id in enumerate(self._ids))
+        self._ids   = list(self._members.keys())
+        self._items = list(self._members.values())
+        indexes     = [old_indexes.get(item_id, -1) for item_id in self._ids]
+        # The parents are checked again (False is never a parent) : a new item may be the parent of other ones
+        self._parents   = [False] * len(self._ids)
+        self._parentIDs = [self._parentIDs[index] if index >= 0 else 0 for index in indexes]
+        self._updateLocal()
+        if numpy is None:
+            self._previous = [self._previous[index] if index >= 0 else None for index in indexes]
+        else:
+            # NaN is different from everything: new rows are always sent
+            previous = numpy.full((len(self._ids), self._encoding.WIDTH), numpy.nan, dtype = numpy.float64)
+            indexes  = numpy.array(indexes, dtype = numpy.intp)
+            known    = (indexes >= 0)
+            if known.any():
+                previous[known] = self._previous[indexes[known]]
+            self._previous  = previous
+            self._ids_array = numpy.array(self._ids, dtype = numpy.int64)
+        self._updateRows()
+        self._changed = False
+
+    def _snapshot(self):
+        objects = [item.getItem() for item in self._items]
+        if len(objects) == 0:
+            return []
+        self._updateParents(objects)
+        if len(self._local_rows) == 0:
+            return self._encoding.snapshot(objects)
+        local = self._encoding.snapshot([objects[index] for index in self._local_rows], True)
+        if len(self._world_rows) == 0:
+            return local
+        world = self._encoding.snapshot([objects[index] for index in self._world_rows])
+        if numpy is None:
+            rows = [None] * len(objects)
+            for indexes, values in ((self._world_rows, world), (self._local_rows, local)):
+                for index, row in zip(indexes, values):
+                    rows[index] = row
+            return rows
+        rows = numpy.empty((len(objects), self._encoding.WIDTH), dtype = world.dtype)
+        rows[self._world_rows] = world
+        rows[self._local_rows] = local
+        return rows
+
+    def _updateParents(self, objects):
+        # Only the objects whose parent is an item of this batch are sent in the space of their parent
+        parents = [object.parent for object in objects]
+        if parents == self._parents:
+            return
+        changed = False
+        for index, parent in enumerate(parents):
+            if parent is self._parents[index]:
+                continue
+            parent_id = 0
+            if parent is not None:
+                item = self.getParent().findItem(parent)
+                if (item is not None) and (self._members.get(item.getItemID()) is item):
+                    parent_id = item.getItemID()
+            if parent_id == self._parentIDs[index]:
+                continue
+            self._parentIDs[index] = parent_id
+            item_id = self._ids[index]
+            if parent_id == 0:
+                self._spaces.pop(item_id, None)
+            else:
+                self._spaces[item_id] = parent_id
+            # In another space : sent again whole, without any delta
+            if numpy is None:
+                self._previous[index] = None
+            else:
+                self._previous[index] = numpy.nan
+            changed = True
+        self._parents = parents
+        if changed:
+            self._updateLocal()
+
+    def _updateRows(self):
+        # Datagram channel : row of each item ID (-1 if it is not inside the layout)
+        if numpy is None:
+            self._rows = dict((item_id, index) for index, item_id in enumerate(self._ids))
+        elif len(self._ids) == 0:
+            self._rows = numpy.empty(0, dtype = numpy.intp)
+        else:
+            self._rows = numpy.full(max(self._ids) + 1, -1, dtype = numpy.intp)
+            self._rows[self._ids_array] = numpy.arange(len(self._ids))
+
+    def _updateLocal(self):
+        self._local_rows = [index for index, parent_id in enumerate(self._parentIDs) if parent_id != 0]
+        self._world_rows = [index for index, parent_id in enumerate(self._parentIDs) if parent_id == 0]
+        if numpy is None:
+            self._local = [parent_id != 0 for parent_id in self._parentIDs]
+        else:
+            self._local = numpy.array(self._parentIDs, dtype = numpy.int64) != 0
+
+    def _getMask(self, different):
+        mask = 0
+        for flag in (POSITION, ORIENTATION, SCALE):
+            for column in getColumns(flag | self._encoding.FLAG):
+                if different(column):
+                    mask |= flag
+                    break
+        return mask
+
+    def _diffNumpy(self, current):
+        different = (current != self._previous)
+        masks     = numpy.zeros(len(current), dtype = numpy.uint8)
+        for flag in (POSITION, ORIENTATION, SCALE):
+            masks[different[:, getColumns(flag | self._encoding.FLAG)].any(axis = 1)] |= flag
+        masks[self._local & (masks != 0)] |= LOCAL
+        groups = []
+        for mask in numpy.unique(masks[masks != 0]):
+            rows = numpy.nonzero(masks == mask)[0]
+            for wire_mask, indexes, values in self._encoding.pack(int(mask), current[rows], self._previous[rows]):
+                if indexes is not None:
+                    rows_ids = rows[indexes]
+                else:
+                    rows_ids = rows
+                groups.append((wire_mask, self._ids_array[rows_ids].tolist(), values))
+        return groups
+
+    def _diffPython(self, current):
+        groups = collections.OrderedDict()
+        for index, row in enumerate(current):
+            previous = self._previous[index]
+            if previous is None:
+                mask = POSITION | ORIENTATION | SCALE
+            else:
+                mask = self._getMask(lambda column: row[column] != previous[column])
+            if (mask != 0) and self._local[index]:
+                mask |= LOCAL
+            if mask != 0:
+                groups.setdefault(mask, []).append(index)
+        result = []
+        for mask, indexes in groups.items():
+            rows     = [current[index] for index in indexes]
+            previous = [self._previous[index] for index in indexes]
+            for wire_mask, subset, values in self._encoding.pack(mask, rows, previous):
+                if subset is not None:
+                    subset = [indexes[index] for index in subset]
+                else:
+                    subset = indexes
+                result.append((wire_mask, [self._ids[index] for index in subset], values))
+        return result
+
+class Slave(blender_cave.base.Base):
+
+    # Weight of the last interval inside the estimation of the master frame period
+    PERIOD_SMOOTHING = 0.1
+    # Extrapolate at most one frame after the last state
+    EXTRAPOLATION_LIMIT = 2.0
+
+    def __init__(self, parent, smoothing = SMOOTHING_NONE):
+        super(Slave, self).__init__(parent)
+        # Last fixed-point position of each item, base of the next deltas
+        self._positions = {}
+        # Last [position, orientation, scale] received for each item, not applied yet
+        self._pending   = {}
+        # Datagram channel : last frame applied, last (mask, row, parent ID) applied to each item and the ones
+        # received before the creation of their item
+        self._datagram  = 0
+        self._applied   = {}
+        self._orphans   = {}
+        # Item ID -> parent item ID of the items whose transformations are in the space of their parent
+        self._spaces    = {}
+
+        self._smoothing = smoothing
+        # Smoothing : last state of each item and (start time, start state, end time, end state) of the moving ones
+        self._states    = {}
+        self._moving    = {}
+        self._updated   = set()
+        self._frame     = None
+        self._previous  = None
+        self._arrival   = None
+        self._period    = None
+
+    def beginFrame(self, frame_time):
+        """Start a new frame, sent by the master at frame_time (master clock, None if unknown)"""
+        if (self._smoothing == SMOOTHING_NONE) or (frame_time is None) or (frame_time == self._frame):
+            return
+        if self._frame is not None:
+            interval = frame_time - self._frame
+            if self._period is None:
+                self._period = interval
+            else:
+                self._period += self.PERIOD_SMOOTHING * (interval - self._period)
+        self._previous = self._frame
+        self._frame    = frame_time
+        self._arrival  = time.time()
+        self._updated  = set()
+
+    def endFrame(self, items):
+        self.flush(items)
+        # The moving items that are not inside this frame did not move since the previous one
+        for item_id in list(self._moving.keys()):
+            if item_id not in self._updated:
+                state = self._states[item_id]
+                self._moving[item_id] = (self._previous, state, self._frame, state)
+
+    def settle(self, frame_time):
+        """The master sent a frame without any change at frame_time : the moving items stay at their last state
+
+        Not an interval between two frames : the next frame starts from there,
+        without changing the estimated period"""
+        if (self._smoothing == SMOOTHING_NONE) or (frame_time is None) or (self._frame is None) or (frame_time <= self._frame):
+            return
+        if self._smoothing == SMOOTHING_EXTRAPOLATE:
+            # Stop at the last state received instead of going on past it
+            for item_id, (start_time, start, end_time, end) in list(self._moving.items()):
+                self._moving[item_id] = (self._frame, end, frame_time, end)
+        self._previous = self._frame
+        self._frame    = frame_time
+        self._arrival  = time.time()
+
+    def process(self, buffer, items):
+        while not buffer.isEmpty():
+            mask  = buffer.unsigned_char()
+            count = buffer.size()
+            ids   = self._extractIDs(buffer, count)
+            if mask & LOCAL:
+                parents = self._extractIDs(buffer, count)
+            else:
+                parents = [0] * count
+            rows  = unpackRows(mask, count, buffer)
+            for item_id, parent_id, row in zip(ids, parents, rows):
+                # Decoded anyway : the compact positions are deltas from the previous ones
+                transforms = self._decode(mask, item_id, row)
+                if _getItem(items, item_id) is None:
+                    continue
+                self._setSpace(item_id, parent_id)
+                try:
+                    pending = self._pending[item_id]
+                except KeyError:
+                    self._pending[item_id] = list(transforms)
+                    continue
+                for index, value in enumerate(transforms):
+                    if value is not None:
+                        pending[index] = value
+
+    def processDatagram(self, frame, buffer, items):
+        """Get the transformations of a datagram frame (the ones that changed since its baseline frame)
+
+        Return False if it cannot be used : older than the last one, or relative to a baseline this slave did not
+        reach yet. The frame holds every item that changed since its baseline, so the items it does not hold did
+        not change since the last frame applied, that is the baseline or a later frame"""
+        baseline = buffer.integer()
+        if (frame <= self._datagram) or (baseline > self._datagram):
+            return False
+        self._datagram = frame
+        for item_id in [item_id for item_id in self._orphans if _getItem(items, item_id) is not None]:
+            self._applyDatagram(item_id, self._orphans.pop(item_id))
+        while not buffer.isEmpty():
+            mask  = buffer.unsigned_char()
+            count = buffer.size()
+            ids   = self._extractIDs(buffer, count)
+            if mask & LOCAL:
+                parents = self._extractIDs(buffer, count)
+            else:
+                parents = [0] * count
+            rows  = unpackRows(mask, count, buffer)
+            for item_id, parent_id, row in zip(ids, parents, rows):
+                value = (mask, tuple(row), parent_id)
+                if _getItem(items, item_id) is None:
+                    # The reliable frame that creates it may come later
+                    self._orphans[item_id] = value
+                else:
+                    self._applyDatagram(item_id, value)
+        return True
+
+    def _applyDatagram(self, item_id, value):
+        if self._applied.get(item_id) == value:
+            return
+        self._applied[item_id] = value
+        self._setSpace(item_id, value[2])
+        self._pending[item_id] = list(self._decode(value[0], item_id, value[1]))
+
+    def flush(self, items, item_id = None):
+        """Apply the pending transformations of the item (all the items by default)"""
+        if item_id is None:
+            pending = self._pending
+            self._pending = {}
+        elif item_id in self._pending:
+            pending = {item_id : self._pending.pop(item_id)}
+        else:
+            return
+        for item_id, (position, orientation, scale) in pending.items():
+            item = _getItem(items, item_id)
+            if item is None:
+                continue
+            parent_id = self._spaces.get(item_id, 0)
+            parent    = _getItem(items, parent_id) if parent_id != 0 else None
+            if (parent_id != 0) and (parent is None):
+                # Relative to a parent deleted since : the master sends it again in world space
+                continue
+            if (self._smoothing == SMOOTHING_NONE) or (self._previous is None):
+                item.setTransforms(position, orientation, scale, parent)
+                self._states.pop(item_id, None)
+            else:
+                self._addState(item_id, item, position, orientation, scale, parent)
+
+    def _setSpace(self, item_id, parent_id):
+        if self._spaces.get(item_id, 0) == parent_id:
+            return
+        if parent_id == 0:
+            del(self._spaces[item_id])
+        else:
+            self._spaces[item_id] = parent_id
+        # The smoothing starts again from the state inside the new space
+        self._states.pop(item_id, None)
+        self._moving.pop(item_id, None)
+
+    def _addState(self, item_id, item, position, orientation, scale, parent):
+        try:
+            start = self._states[item_id]
+        except KeyError:
+            current = item.getTransforms(parent is not None)
+            start   = (list(current[0]), list(current[1].to_quaternion()), list(current[2]))
+        end = list(start)
+        if position is not None:
+            end[0] = list(position)
+        if orientation is not None:
+            end[1] = list(orientation.to_quaternion())
+        if scale is not None:
+            end[2] = list(scale)
+        self._states[item_id] = end
+        self._moving[item_id] = (self._previous, start, self._frame, end)
+        self._updated.add(item_id)
+
+    def remove(self, item_id):
+        self._positions.pop(item_id, None)
+        self._pending.pop(item_id, None)
+        self._applied.pop(item_id, None)
+        self._orphans.pop(item_id, None)
+        self._spaces.pop(item_id, None)
+        self._states.pop(item_id, None)
+        self._moving.pop(item_id, None)
+
+    def render(self, items):
+        """Apply the smoothed transformations of the moving items, at each rendering"""
+        if len(self._moving) == 0:
+            return
+        render_time = self._frame + (time.time() - self._arrival)
+        if self._smoothing == SMOOTHING_INTERPOLATE:
+            render_time -= self._period
+            limit = 1.0
+        else:
+            limit = self.EXTRAPOLATION_LIMIT
+        for item_id, (start_time, start, end_time, end) in list(self._moving.items()):
+            item      = _getItem(items, item_id)
+            parent_id = self._spaces.get(item_id, 0)
+            parent    = _getItem(items, parent_id) if parent_id != 0 else None
+            if (item is None) or ((parent_id != 0) and (parent is None)):
+                self.remove(item_id)
+                continue
+            if end_time > start_time:
+                factor = max(0.0, min(limit, (render_time - start_time) / (end_time - start_time)))
+            else:
+                factor = 1.0
+            if (start == end) or ((factor >= 1.0) and (self._smoothing == SMOOTHING_INTERPOLATE)):
+                # Settled : nothing to do until its next move
+                item.setTransforms(end[0], mathutils.Quaternion(end[1]).to_matrix(), end[2], parent)
+                del(self._moving[item_id])
+                continue
+            item.setTransforms(_lerp(start[0], end[0], factor),
+                               mathutils.Quaternion(_slerp(start[1], end[1], factor)).to_matrix(),
+                               _lerp(start[2], end[2], factor), parent)
+
+    def _decode(self, mask, item_id, row):
+        position = orientation = scale = None
+        offset   = 0
+        if mask & COMPACT:
+            if mask & POSITION:
+                fixed = row[0:3]
+                if mask & DELTA:
+                    previous = self._positions.get(item_id)
+                    if previous is not None:
+                        fixed = [previous[index] + fixed[index] for index in range(3)]
+                    else:
+                        fixed = None
+                if fixed is not None:
+                    self._positions[item_id] = fixed
+                    position = [value * POSITION_STEP for value in fixed]
+                offset   = 3
+            if mask & ORIENTATION:
+                orientation = _fromSmallestThree(row[offset:offset + 4])
+                offset     += 4
+        else:
+            if mask & POSITION:
+                position = row[0:3]
+                offset   = 3
+            if mask & ORIENTATION:
+                orientation = mathutils.Matrix((row[offset    :offset + 3],
+                                                row[offset + 3:offset + 6],
+                                                row[offset + 6:offset + 9]))
+                offset     += 9
+        if mask & SCALE:
+            scale = row[offset:offset + 3]
+        return position, orientation, scale
+
+    def _extractIDs(self, buffer, count):
+        return buffer.itemIDs(count = count)
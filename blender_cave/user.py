@@ -99,6 +99,20 @@ class User(blender_cave.base.Base):
 
         return buffer
 
+    def getSnapshotBuffer(self):
+        buffer = blender_cave.buffer.Buffer()
+
+        # Positions are only known by the slaves once sent
+        if (self._previous['user_position'] != 0):
+            buffer.command(self.SYNCHRONIZER_COMMAND_USER_POSITION)
+            buffer.matrix_4x4(self._previous['user_position'])
+
+        if (self._previous['vehicle_position'] != 0):
+            buffer.command(self.SYNCHRONIZER_COMMAND_VEHICLE_POSITION)
+            buffer.matrix_4x4(self._previous['vehicle_position'])
+
+        return buffer
+
     def processSynchronizerBuffer(self, buffer):
         while not buffer.isEmpty():
             command = buffer.command()